@@ -2,7 +2,8 @@ import pandas as pd
 import json
 import os
 import logging
-from utils import get_http_session
+from concurrent.futures import ThreadPoolExecutor
+from utils import fetch_with_cache, read_csv_with_retry, read_parquet_with_retry, to_int64, write_csv
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +13,32 @@ FILES_URL = os.environ.get("FILES_URL", "https://files.planning.data.gov.uk")
 ENDPOINT_URL = "https://datasette.planning.data.gov.uk/digital-land/expectation.json?passed__exact=False&operation__exact=count_deleted_entities&_sort=rowid&_size=max"
 ORG_URL = "https://datasette.planning.data.gov.uk/digital-land/organisation.csv?_stream=on"
 
+# Upper bound on concurrent parquet downloads
+MAX_WORKERS = 8
+
+
+def load_entity_parquet(dataset_name: str, url: str):
+    """
+    Load entity, name and reference for a dataset from its parquet file.
+
+    Returns None if the parquet file can't be read.
+    """
+    try:
+        df_entity = read_parquet_with_retry(url, columns=['entity', 'name', 'reference'])
+    except Exception as e:
+        logger.error(f"Failed to load {dataset_name}: {e}")
+        return None
+
+    missing = [c for c in ['entity', 'name'] if c not in df_entity.columns]
+    if missing:
+        logger.error(f"Failed to load {dataset_name}: missing columns {missing}")
+        return None
+    if 'reference' not in df_entity.columns:
+        df_entity['reference'] = ''
+
+    df_entity['dataset'] = dataset_name
+    return df_entity
+
 
 def main(output_dir: str):
     """
@@ -21,30 +48,25 @@ def main(output_dir: str):
     # ---------------------------------------------------------------
     # Load and filter expectations
     # ---------------------------------------------------------------
-    response = get_http_session().get(ENDPOINT_URL)
-    response.raise_for_status()
-    data = response.json()
+    data = json.loads(fetch_with_cache(ENDPOINT_URL))
     df = pd.DataFrame(data['rows'], columns=data['columns'])
-    df_filtered = df[['dataset', 'organisation', 'details']].copy()
 
-    # Parse JSON and extract entities list
-    df_filtered['entities'] = df_filtered['details'].apply(
-        lambda x: json.loads(x)['entities']
-    )
-
-    # Explode to one entity per row
-    df_expanded = df_filtered.explode('entities')[
-        ['dataset', 'organisation', 'entities']
-    ].copy()
-    df_expanded = df_expanded.reset_index(drop=True)
+    # Parse JSON and flatten the entities list to one entity per row; an empty list keeps
+    # one row with a blank entity, as explode did
+    rows = [
+        (dataset, organisation, entity)
+        for dataset, organisation, details in zip(df['dataset'], df['organisation'], df['details'])
+        for entity in (json.loads(details)['entities'] or [None])
+    ]
+    df_expanded = pd.DataFrame(rows, columns=['dataset', 'organisation', 'entities'])
 
     #print(f"Found {len(df_expanded)} entities across {df_expanded['dataset'].nunique()} datasets")
 
     # ---------------------------------------------------------------
     # Load and merge organisation data
     # ---------------------------------------------------------------
-    df_org = pd.read_csv(ORG_URL)
-    df_org = df_org[['entity', 'organisation', 'name']].copy()
+    df_org = read_csv_with_retry(ORG_URL)
+    df_org = df_org[['entity', 'organisation', 'name']]
     df_org = df_org.rename(
         columns={
             'entity': 'organisation_entity',
@@ -65,28 +87,17 @@ def main(output_dir: str):
         for dataset in unique_datasets
     }
 
+    # Downloads are network-bound, so fetch the parquet files concurrently
     entity_dfs = []
-    for dataset_name, url in ENTITY_URLS.items():
-        try:
-            df_entity = pd.read_parquet(url, columns=['entity', 'name', 'reference'])
-        except Exception:
-            try:
-                df_entity = pd.read_parquet(url, columns=['entity', 'name'])
-                df_entity['reference'] = ''
-            except Exception as e:
-                logger.error(f"Failed to load {dataset_name}: {e}")
-                continue
-
-        df_entity['dataset'] = dataset_name
-        entity_dfs.append(df_entity)
+    if ENTITY_URLS:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(ENTITY_URLS))) as executor:
+            results = executor.map(load_entity_parquet, ENTITY_URLS.keys(), ENTITY_URLS.values())
+            entity_dfs = [df_entity for df_entity in results if df_entity is not None]
 
     if not entity_dfs:
         logger.error("No entity datasets loaded successfully")
         os.makedirs(output_dir, exist_ok=True)
-        df_final.to_csv(
-            os.path.join(output_dir, 'deleted_entities.csv'),
-            index=False
-        )
+        write_csv(df_final, os.path.join(output_dir, 'deleted_entities.csv'))
         return
 
     # ---------------------------------------------------------------
@@ -95,12 +106,8 @@ def main(output_dir: str):
     df_entities = pd.concat(entity_dfs, ignore_index=True)
 
     # Normalize entity IDs to numeric for consistent merging
-    df_entities['entity'] = pd.to_numeric(
-        df_entities['entity'], errors='coerce'
-    ).astype('Int64')
-    df_final['entity'] = pd.to_numeric(
-        df_final['entity'], errors='coerce'
-    ).astype('Int64')
+    df_entities['entity'] = to_int64(df_entities['entity'])
+    df_final['entity'] = to_int64(df_final['entity'])
 
     # Merge with entity metadata
     df_final = df_final.merge(
@@ -124,14 +131,14 @@ def main(output_dir: str):
         'reference'
     ]
 
-    df_final = df_final[final_cols].copy()
+    df_final = df_final[final_cols]
 
     # ---------------------------------------------------------------
     # Save output
     # ---------------------------------------------------------------
     os.makedirs(output_dir, exist_ok=True)
     output_file = os.path.join(output_dir, 'deleted_entities.csv')
-    df_final.to_csv(output_file, index=False)
+    write_csv(df_final, output_file)
 
 def parse_args():
     import argparse
@@ -1,15 +1,23 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import ast
+import json
 import argparse
 import os
 import logging
-from utils import read_csv_with_retry
+from concurrent.futures import ThreadPoolExecutor
+from utils import read_csv_arrow, read_parquet_with_retry, to_int64, write_csv
 logger = logging.getLogger(__name__)
 
 FILES_URL = os.environ.get("FILES_URL", "https://files.planning.data.gov.uk")
 
-# Load expectations table
-EXPECTATIONS_URL = "https://datasette.planning.data.gov.uk/digital-land/expectation.csv?_stream=on"
+# Load expectations table, filtered to duplicate geometry checks by Datasette
+EXPECTATIONS_URL = (
+    "https://datasette.planning.data.gov.uk/digital-land/expectation.csv"
+    "?_stream=on&operation__exact=duplicate_geometry_check"
+)
 
 # Entity tables to enrich A/B sides
 ENTITY_URLS = {
@@ -30,254 +38,261 @@ LOOKUP_URLS = {
     "tree": f"{FILES_URL}/config/pipeline/tree-preservation-order/lookup.csv",
 }
 
-# Load provision table to check if LPA is in ODP
-ODP_URL = "https://datasette.planning.data.gov.uk/digital-land/provision.csv?_stream=on"
+# Provision rows for the open-digital-planning project, used to check if an LPA is in ODP
+ODP_URL = (
+    "https://datasette.planning.data.gov.uk/digital-land/provision.csv"
+    "?project__exact=open-digital-planning&_stream=on"
+)
+
+# Entity columns kept for each side; dataset isn't read from the parquet files, it's stamped from the URL key
+ENTITY_COLS = [
+    "entity",
+    "end_date",
+    "entry_date",
+    "geometry",
+    "name",
+    "organisation_entity",
+]
+# Parquet files use hyphenated column names; map to underscore equivalents
+PARQUET_COL_MAP = {
+    "entity": "entity",
+    "end-date": "end_date",
+    "entry-date": "entry_date",
+    "geometry": "geometry",
+    "name": "name",
+    "organisation-entity": "organisation_entity",
+}
+
+# Upper bound on concurrent downloads
+MAX_WORKERS = 8
 
 
 def parse_details(val):
+    # details are normally JSON, so try the C parser before falling back to Python literals
+    try:
+        return json.loads(val)
+    except (TypeError, ValueError):
+        pass
     try:
         return ast.literal_eval(val)
     except Exception:
         return {}
 
 
-def main(output_dir: str):
+def to_int64_array(values):
+    # ids in details are normally ints, so only fall back to a numeric parse when they aren't
+    try:
+        return pd.array(values, dtype="Int64")
+    except (TypeError, ValueError):
+        return to_int64(pd.Series(values, dtype=object)).array
+
+
+def load_entity_table(dataset_name, entity_url, dataset_dtype, entity_ids):
+    """
+    Load the entity columns for the given entities of one dataset, tagged with its dataset key.
+
+    Returns None if the parquet file lacks any of the required columns.
+    """
+    try:
+        # Ask for both spellings in one read in case column names already use underscores,
+        # and only decode rows for entities that appear in a match
+        t = read_parquet_with_retry(
+            entity_url,
+            columns=list(PARQUET_COL_MAP.keys()) + ENTITY_COLS,
+            filters=[("entity", "in", entity_ids)],
+        )
+        t = t.rename(columns=PARQUET_COL_MAP)
+        # Only files carrying both spellings need de-duplicating, which copies every column
+        if t.columns.duplicated().any():
+            t = t.loc[:, ~t.columns.duplicated()]
+        missing = [c for c in ENTITY_COLS if c not in t.columns]
+        if missing:
+            return None
+        t["entity"] = to_int64(t["entity"])
+        t["organisation_entity"] = to_int64(t["organisation_entity"])
+        t = t[ENTITY_COLS]
+        t.insert(1, "dataset", pd.Categorical([dataset_name] * len(t), dtype=dataset_dtype))
+        return t
+    except Exception as e:
+        logger.error(f"Failed to load entity table for dataset: {dataset_name} from {entity_url}")
+        raise e
+
+
+def enrich_side(df_matches, ent_idx, org_names, side):
+    """
+    Look up entity metadata and organisation name for one side ("a" or "b") of each match.
+
+    Returns the new entity_<side>_* columns aligned to df_matches' index.
+    """
+    prefix = f"entity_{side}_"
+    # Prefix column labels without copying the entity data (add_prefix would copy every column)
+    ent = ent_idx.rename(columns=lambda c: f"{prefix}{c}", copy=False)
+    keys = df_matches[["dataset", f"entity_{side}"]]
+    enriched = keys.join(ent, on=["dataset", f"entity_{side}"]).drop(columns=keys.columns)
+    enriched[f"{prefix}organisation_name"] = enriched[f"{prefix}organisation_entity"].map(org_names)
+    return enriched
+
+
+def main(output_dir: str, compress: bool = False):
+    # Optionally gzip the outputs to cut disk and upload size; the geometry CSV compresses well
+    ext = ".csv.gz" if compress else ".csv"
+    # Level 1 keeps most of the size saving at a fraction of the default level's CPU time
+    compression = {"method": "gzip", "compresslevel": 1} if compress else "infer"
     # ------------------------------------------------------------
     # Load and filter expectations
     # ------------------------------------------------------------
-    df = pd.read_csv(EXPECTATIONS_URL, low_memory=False)
-    df = df[df["operation"] == "duplicate_geometry_check"].copy()
+    df = read_csv_arrow(EXPECTATIONS_URL, {"dataset": pa.string(), "operation": pa.string(), "details": pa.string()})
     if df.empty:
         os.makedirs(output_dir, exist_ok=True)
-        out = os.path.join(output_dir, "duplicate_entity_expectation.csv")
-        pd.DataFrame().to_csv(out, index=False)
+        out = os.path.join(output_dir, f"duplicate_entity_expectation{ext}")
+        write_csv(pd.DataFrame(), out, compression=compression)
         return
 
-    df["details_parsed"] = df["details"].apply(parse_details)
+    details_parsed = [parse_details(s) for s in df["details"].to_numpy()]
 
     # ------------------------------------------------------------
     # Extract match records
     # ------------------------------------------------------------
-    records = []
-    for _, row in df.iterrows():
-        dataset = row["dataset"]
-        operation = row["operation"]
-        details = row["details_parsed"] or {}
-
-        for match in details.get("complete_matches", []):
-            records.append(
-                {
-                    "dataset": dataset,
-                    "operation": operation,
-                    "message": "complete_match",
-                    "entity_a": match.get("entity_a"),
-                    "organisation_entity_a": match.get("organisation_entity_a"),
-                    "entity_b": match.get("entity_b"),
-                    "organisation_entity_b": match.get("organisation_entity_b"),
-                }
-            )
-        for match in details.get("single_matches", []):
-            records.append(
-                {
-                    "dataset": dataset,
-                    "operation": operation,
-                    "message": "single_match",
-                    "entity_a": match.get("entity_a"),
-                    "organisation_entity_a": match.get("organisation_entity_a"),
-                    "entity_b": match.get("entity_b"),
-                    "organisation_entity_b": match.get("organisation_entity_b"),
-                }
-            )
-
-    df_matches = pd.DataFrame.from_records(records)
+    # One record per match, keeping each expectation's complete matches ahead of its single matches
+    match_types = [("complete_matches", "complete_match"), ("single_matches", "single_match")]
+    match_fields = ["entity_a", "organisation_entity_a", "entity_b", "organisation_entity_b"]
+    records = [
+        (dataset, operation, message, *(match.get(f) for f in match_fields))
+        for dataset, operation, details in zip(df["dataset"], df["operation"], details_parsed)
+        for key, message in match_types
+        for match in (details or {}).get(key, [])
+    ]
+
+    # Build column-wise so the id columns are typed as Int64 up front rather than coerced later
+    columns = ["dataset", "operation", "message"] + match_fields
+    values = dict(zip(columns, map(list, zip(*records)))) if records else {c: [] for c in columns}
+    for c in match_fields:
+        values[c] = to_int64_array(values[c])
+    # operation and message only take a handful of values, so store them as categorical codes
+    values["operation"] = pd.Categorical(values["operation"])
+    values["message"] = pd.Categorical(values["message"], categories=[m for _, m in match_types])
+    df_matches = pd.DataFrame(values)
 
     # Bail early if no matches
     if df_matches.empty:
         os.makedirs(output_dir, exist_ok=True)
-        out = os.path.join(output_dir, "duplicate_entity_expectation.csv")
-        df_matches.to_csv(out, index=False)
+        out = os.path.join(output_dir, f"duplicate_entity_expectation{ext}")
+        write_csv(df_matches, out, compression=compression)
         return
 
     # ------------------------------------------------------------
     # Load & prep entity tables
     # ------------------------------------------------------------
-    cols = [
-        "entity",
-        "dataset",
-        "end_date",
-        "entry_date",
-        "geometry",
-        "name",
-        "organisation_entity",
-    ]
-    # Parquet files use hyphenated column names; map to underscore equivalents
-    parquet_col_map = {
-        "entity": "entity",
-        "dataset": "dataset",
-        "end-date": "end_date",
-        "entry-date": "entry_date",
-        "geometry": "geometry",
-        "name": "name",
-        "organisation-entity": "organisation_entity",
+    # Only datasets with matches are ever joined, so skip downloading the rest
+    datasets_with_matches = set(df_matches["dataset"].dropna())
+    entity_urls = {k: v for k, v in ENTITY_URLS.items() if k in datasets_with_matches}
+
+    # Share one categorical dtype for the dataset key so joins compare integer codes
+    dataset_dtype = pd.CategoricalDtype(sorted(datasets_with_matches))
+
+    # Entities referenced on either side of a match, per dataset
+    entity_ids = {
+        dataset: sorted(set(group["entity_a"].dropna()) | set(group["entity_b"].dropna()))
+        for dataset, group in df_matches.groupby("dataset")
     }
-    entity_tbls = []
-    for dataset_name, entity_url in ENTITY_URLS.items():
-        try:
-            try:
-                t = pd.read_parquet(entity_url, columns=list(parquet_col_map.keys()))
-                t = t.rename(columns=parquet_col_map)
-            except Exception:
-                # Fall back if column names already use underscores
-                t = pd.read_parquet(entity_url, columns=cols)
-            missing = [c for c in ["entity", "end_date", "entry_date", "geometry", "name", "organisation_entity"] if c not in t.columns]
-            if missing:
-                continue
-            t["entity"] = pd.to_numeric(t["entity"], errors="coerce").astype("Int64")
-            t["organisation_entity"] = pd.to_numeric(t["organisation_entity"], errors="coerce").astype("Int64")
-            entity_tbls.append(t[cols].copy())
-        except Exception as e:
-            logger.error(f"Failed to load entity table for dataset: {dataset_name} from {entity_url}")
-            raise e
 
+    # Downloads are network-bound, so fetch entity tables and lookups concurrently
+    lookup_urls = {LOOKUP_URLS[d] for d in datasets_with_matches if d in LOOKUP_URLS}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        orgs_future = executor.submit(read_csv_arrow, ORGS_URL, {"entity": pa.int64(), "name": pa.string()})
+        provision_future = executor.submit(read_csv_arrow, ODP_URL, {"organisation": pa.string()})
+        lookup_futures = {
+            url: executor.submit(read_csv_arrow, url, {"organisation": pa.string(), "entity": pa.int64()})
+            for url in lookup_urls
+        }
+        results = executor.map(
+            load_entity_table,
+            entity_urls.keys(),
+            entity_urls.values(),
+            [dataset_dtype] * len(entity_urls),
+            [entity_ids[d] for d in entity_urls],
+        )
+        entity_tbls = [t for t in results if t is not None]
 
     if not entity_tbls:
         # No enrichment possible, just save what we have
         os.makedirs(output_dir, exist_ok=True)
-        out = os.path.join(output_dir, "duplicate_entity_expectation.csv")
-        df_matches.to_csv(out, index=False)
+        out = os.path.join(output_dir, f"duplicate_entity_expectation{ext}")
+        write_csv(df_matches, out, compression=compression)
         return
 
     df_entities = pd.concat(entity_tbls, ignore_index=True)
 
+    df_matches["dataset"] = df_matches["dataset"].astype(dataset_dtype)
+
     # ------------------------------------------------------------
     # Load orgs lookup
     # ------------------------------------------------------------
     df_orgs = (
-        pd.read_csv(ORGS_URL, low_memory=False)[["entity", "name"]]
+        orgs_future.result()
         .rename(columns={"entity": "organisation_entity", "name": "organisation_name"})
-        .copy()
     )
-    df_orgs["organisation_entity"] = pd.to_numeric(df_orgs["organisation_entity"], errors="coerce").astype("Int64")
+    # Organisation names keyed by entity, looked up for both sides of each match
+    org_names = df_orgs.set_index("organisation_entity")["organisation_name"]
+    if not org_names.index.is_unique:
+        raise ValueError("Organisation table contains duplicate entity keys")
 
     # ------------------------------------------------------------
-    # Normalize match key dtypes
+    # Merge metadata and orgs for A and B
     # ------------------------------------------------------------
-    for c in ["entity_a", "entity_b", "organisation_entity_a", "organisation_entity_b"]:
-        if c in df_matches.columns:
-            df_matches[c] = pd.to_numeric(df_matches[c], errors="coerce").astype("Int64")
-
-    # ------------------------------------------------------------
-    # Merge metadata for A
-    # ------------------------------------------------------------
-    entA = df_entities.add_prefix("entity_a_")
-    df_matches = df_matches.merge(
-        entA,
-        how="left",
-        left_on=["dataset", "entity_a"],
-        right_on=["entity_a_dataset", "entity_a_entity"],
-        validate="m:1",
-        suffixes=("", "_drop"),
-    )
-    del entA
-
-    # Orgs for A
-    df_matches = df_matches.merge(
-        df_orgs.rename(columns={"organisation_name": "entity_a_organisation_name"}),
-        how="left",
-        left_on="entity_a_organisation_entity",
-        right_on="organisation_entity",
-        validate="m:1",
-        suffixes=("", "_orgA"),
-    )
-
-    # ------------------------------------------------------------
-    # Merge metadata for B
-    # ------------------------------------------------------------
-    entB = df_entities.add_prefix("entity_b_")
+    # Index the entity table once so both sides join against the same lookup
+    ent_idx = df_entities.set_index(["dataset", "entity"])
     del df_entities
-    df_matches = df_matches.merge(
-        entB,
-        how="left",
-        left_on=["dataset", "entity_b"],
-        right_on=["entity_b_dataset", "entity_b_entity"],
-        validate="m:1",
-        suffixes=("", "_dropB"),
-    )
-    del entB
-
-    # Orgs for B
-    df_matches = df_matches.merge(
-        df_orgs.rename(columns={"organisation_name": "entity_b_organisation_name"}),
-        how="left",
-        left_on="entity_b_organisation_entity",
-        right_on="organisation_entity",
-        validate="m:1",
-        suffixes=("", "_orgB"),
-    )
+    if not ent_idx.index.is_unique:
+        raise ValueError("Entity tables contain duplicate (dataset, entity) keys")
+
+    sides = [enrich_side(df_matches, ent_idx, org_names, side) for side in ("a", "b")]
+    df_matches = pd.concat([df_matches] + sides, axis=1)
+    del ent_idx
 
     # ------------------------------------------------------------
     # Create stable shorthand org columns (so they don't vanish)
     # Prefer the enriched *_organisation_entity; fall back to originals
     # ------------------------------------------------------------
-    df_matches["entity_a_organisation"] = (
-        df_matches.get("entity_a_organisation_entity").combine_first(df_matches.get("organisation_entity_a"))
+    # Both columns share df_matches' index, so fillna is a plain masked fill with no alignment work
+    df_matches["entity_a_organisation"] = df_matches["entity_a_organisation_entity"].fillna(
+        df_matches["organisation_entity_a"]
     )
-    df_matches["entity_b_organisation"] = (
-        df_matches.get("entity_b_organisation_entity").combine_first(df_matches.get("organisation_entity_b"))
+    df_matches["entity_b_organisation"] = df_matches["entity_b_organisation_entity"].fillna(
+        df_matches["organisation_entity_b"]
     )
 
     # ------------------------------------------------------------
     # Merge in organisations from lookup
     # ------------------------------------------------------------
-    # Get unique datasets that have matches
-    datasets_in_matches = df_matches["dataset"].unique()
-
-    # Process each dataset separately
-    results = []
-    for dataset in datasets_in_matches:
-        df_subset = df_matches[df_matches["dataset"] == dataset].copy()
-        
-        # Load the appropriate lookup for this dataset
+    # Stack every dataset's lookup under its dataset key so both sides need a single join
+    lookup_tbls = []
+    for dataset in sorted(datasets_with_matches):
         if dataset in LOOKUP_URLS:
             try:
-                df_lookup = read_csv_with_retry(LOOKUP_URLS[dataset], low_memory=False)
-                df_lookup = df_lookup[["organisation", "entity"]].drop_duplicates(subset=["entity"], keep="first").copy()
-                
-                # Merge for entity_a
-                df_subset = df_subset.merge(
-                    df_lookup.rename(columns={"organisation": "lookup_org_a"}),
-                    how="left",
-                    left_on="entity_a",
-                    right_on="entity",
-                    validate="m:1",
-                )
-                # Merge for entity_b
-                df_subset = df_subset.merge(
-                    df_lookup.rename(columns={"organisation": "lookup_org_b"}),
-                    how="left",
-                    left_on="entity_b",
-                    right_on="entity",
-                    validate="m:1",
-                )
+                df_lookup = lookup_futures[LOOKUP_URLS[dataset]].result()
             except Exception as e:
                 logger.error(f"Failed to load lookup for {dataset}: {e}")
-        
-        results.append(df_subset)
-
-    df_matches = pd.concat(results, ignore_index=True)
-
-    # ------------------------------------------------------------
-    # Clean up helper columns if present
-    # ------------------------------------------------------------
-    drop_cols = [
-        "entity_a_dataset",
-        "entity_b_dataset",
-        "organisation_entity_orgA",
-        "organisation_entity_orgB",
-    ]
-    for c in drop_cols:
-        if c in df_matches.columns:
-            df_matches.drop(columns=[c], inplace=True)
+                continue
+            df_lookup = df_lookup.drop_duplicates(subset=["entity"], keep="first")
+            df_lookup.insert(0, "dataset", pd.Categorical([dataset] * len(df_lookup), dtype=dataset_dtype))
+            lookup_tbls.append(df_lookup)
+
+    if lookup_tbls:
+        lookups = pd.concat(lookup_tbls, ignore_index=True).set_index(["dataset", "entity"])["organisation"]
+    else:
+        lookups = pd.Series(
+            [], dtype=object, name="organisation",
+            index=pd.MultiIndex.from_arrays(
+                [pd.Categorical([], dtype=dataset_dtype), pd.array([], dtype="Int64")], names=["dataset", "entity"]
+            ),
+        )
+
+    # Keep rows grouped by dataset in order of first appearance, as the per-dataset merges did
+    dataset_order = pd.factorize(df_matches["dataset"])[0]
+    df_matches = df_matches.take(np.argsort(dataset_order, kind="stable")).reset_index(drop=True)
+    df_matches = df_matches.join(lookups.rename("lookup_org_a"), on=["dataset", "entity_a"])
+    df_matches = df_matches.join(lookups.rename("lookup_org_b"), on=["dataset", "entity_b"])
 
     # ------------------------------------------------------------
     # Create comparison column
@@ -288,10 +303,13 @@ def main(output_dir: str):
     # Check if entity B organisation is in ODP
     # ------------------------------------------------------------
     try:
-        df_provision = pd.read_csv(ODP_URL, low_memory=False)
-        # Get organisations that are in the open-digital-planning project
-        odp_orgs = set(df_provision[df_provision["project"] == "open-digital-planning"]["organisation"].unique())
-        df_matches["in_odp"] = df_matches["lookup_org_b"].isin(odp_orgs)
+        # The project filter is applied by Datasette, so every row is an ODP organisation
+        odp_orgs = provision_future.result()["organisation"].dropna().unique()
+        # Membership test in Arrow's hash kernel rather than hashing Python objects per row
+        df_matches["in_odp"] = pc.is_in(
+            pa.array(df_matches["lookup_org_b"], type=pa.string(), from_pandas=True),
+            value_set=pa.array(odp_orgs, type=pa.string()),
+        ).to_numpy(zero_copy_only=False)
     except Exception as e:
         logger.error(f"Failed to load ODP provision data: {e}")
         df_matches["in_odp"] = False
@@ -317,34 +335,34 @@ def main(output_dir: str):
         "entity_b_entry_date",
         "entity_b_end_date",
         "entity_b_geometry",
-        "organisation_entity_a", # keep originals for auditing
-        "organisation_entity_b", # keep originals for auditing
         "lookup_org_a",
         "lookup_org_b",
         "lookup_same_org",
         "in_odp"
     ]
-    ordered = [c for c in ordered if c in df_matches.columns]
-    df_matches = df_matches[ordered].copy()
-    df_matches.drop(columns=["organisation_entity_a", "organisation_entity_b"], inplace=True)
+    # Select and reorder in one pass without copying the column data
+    df_matches = df_matches.reindex(columns=[c for c in ordered if c in df_matches.columns], copy=False)
 
     # ------------------------------------------------------------
     # Save
     # ------------------------------------------------------------
     os.makedirs(output_dir, exist_ok=True)
-    out_csv = os.path.join(output_dir, "duplicate_entity_expectation.csv")
-    df_matches.drop(columns=["entity_a_geometry", "entity_b_geometry"]).to_csv(out_csv, index=False) # Geometry fields are large, so drop for report CSV
+    out_csv = os.path.join(output_dir, f"duplicate_entity_expectation{ext}")
+    report_cols = [c for c in df_matches.columns if c not in ("entity_a_geometry", "entity_b_geometry")]
+    # Geometry fields are large, so drop for report CSV
+    write_csv(df_matches, out_csv, columns=report_cols, compression=compression)
 
-    out_geog_csv = os.path.join(output_dir, "duplicate_entity_expectation_geographies.csv") # Keep geometry fields for geospatial analysis, but save separately
-    df_matches.to_csv(out_geog_csv, index=False)
+    out_geog_csv = os.path.join(output_dir, f"duplicate_entity_expectation_geographies{ext}") # Keep geometry fields for geospatial analysis, but save separately
+    write_csv(df_matches, out_geog_csv, compression=compression)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Duplicate geometry checker – extract and enrich duplicates")
     parser.add_argument("--output-dir", type=str, required=True)
+    parser.add_argument("--compress", action="store_true", help="Write gzip-compressed .csv.gz outputs")
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args.output_dir)
\ No newline at end of file
+    main(args.output_dir, args.compress)
\ No newline at end of file
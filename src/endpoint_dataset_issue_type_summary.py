@@ -1,6 +1,6 @@
 import os
 import argparse
-from utils import read_csv_with_retry
+from utils import read_csv_with_retry, write_csv
 
 def full_datasette_table(tables, output_dir):
     """
@@ -18,7 +18,7 @@ def full_datasette_table(tables, output_dir):
             df = read_csv_with_retry(full_url, low_memory=False)  # Load full dataset
             csv_name = f"{name}.csv"
             save_path = os.path.join(output_dir, csv_name)
-            df.to_csv(save_path, index=False)  # Save to CSV without index
+            write_csv(df, save_path)  # Save to CSV without index
             print(f"Saved: {save_path}")
         except Exception as e:
             print(f"[ERROR] Failed to fetch {name}: {e}")
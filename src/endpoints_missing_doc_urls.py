@@ -1,30 +1,27 @@
 import pandas as pd
+import pyarrow as pa
 import os
 import argparse
-from utils import get_http_session
+from concurrent.futures import ThreadPoolExecutor
+from utils import read_csv_arrow, write_csv
 
 # Constants
-DATASSETTE_URL = "https://datasette.planning.data.gov.uk/digital-land.json"
-
-# Base SQL query to retrieve endpoint metadata
-BASE_SQL = """
-SELECT 
-    o.name,
-    s.organisation, 
-    sp.pipeline AS "pipeline/dataset", 
-    e.endpoint_url, 
-    s.documentation_url,
-    s.entry_date,
-    s.end_date,
-    e.endpoint
-FROM 
-    endpoint e
-    INNER JOIN source s ON e.endpoint = s.endpoint
-    INNER JOIN source_pipeline sp ON s.source = sp.source
-    INNER JOIN organisation o ON o.organisation = s.organisation
-ORDER BY s.entry_date DESC
-LIMIT 1000 OFFSET {offset}
-"""
+TABLE_URL = "https://datasette.planning.data.gov.uk/digital-land/{table}.csv?_stream=on"
+
+# Columns streamed from each table to rebuild the endpoint metadata joins
+TABLE_COLUMNS = {
+    "endpoint": {"endpoint": pa.string(), "endpoint_url": pa.string()},
+    "source": {
+        "source": pa.string(),
+        "endpoint": pa.string(),
+        "organisation": pa.string(),
+        "documentation_url": pa.string(),
+        "entry_date": pa.string(),
+        "end_date": pa.string(),
+    },
+    "source_pipeline": {"source": pa.string(), "pipeline": pa.string()},
+    "organisation": {"organisation": pa.string(), "name": pa.string()},
+}
 
 def parse_args():
     """
@@ -41,35 +38,34 @@ def parse_args():
 
 def fetch_endpoint_data():
     """
-    Fetches all endpoint metadata using paginated SQL from Datasette API.
+    Fetches all endpoint metadata by streaming the underlying Datasette tables and joining them locally.
+
+    Each table is a single streamed CSV request, fetched concurrently, rather than one
+    paginated SQL query per 1000 rows.
 
     Returns:
-        pd.DataFrame: Combined result of all pages as a DataFrame.
+        pd.DataFrame: Endpoints joined with their sources, pipelines and organisations, newest first.
     """
-    all_rows, offset = [], 0
-    columns = []
-
-    while True:
-        paginated_sql = BASE_SQL.format(offset=offset)
-        response = get_http_session().get(DATASSETTE_URL, params={"sql": paginated_sql, "_size": 1000})
-
-        if response.status_code != 200:
-            print("Failed to fetch data from Datasette.")
-            break
-
-        json_data = response.json()
-        rows = json_data.get("rows", [])
-
-        if not rows:
-            break
-
-        if offset == 0:
-            columns = json_data.get("columns", [])
-
-        all_rows.extend(rows)
-        offset += 1000
-
-    return pd.DataFrame(all_rows, columns=columns) if all_rows else pd.DataFrame()
+    with ThreadPoolExecutor(max_workers=len(TABLE_COLUMNS)) as executor:
+        futures = {
+            table: executor.submit(read_csv_arrow, TABLE_URL.format(table=table), columns)
+            for table, columns in TABLE_COLUMNS.items()
+        }
+    tables = {table: future.result() for table, future in futures.items()}
+
+    df = (
+        tables["endpoint"]
+        .merge(tables["source"], on="endpoint")
+        .merge(tables["source_pipeline"], on="source")
+        .merge(tables["organisation"], on="organisation")
+        .sort_values("entry_date", ascending=False, kind="stable")
+        .rename(columns={"pipeline": "pipeline/dataset"})
+    )
+    columns = [
+        "name", "organisation", "pipeline/dataset", "endpoint_url",
+        "documentation_url", "entry_date", "end_date", "endpoint",
+    ]
+    return df[columns].reset_index(drop=True)
 
 def analyze_missing_docs(df):
     """
@@ -101,8 +97,8 @@ def analyze_missing_docs(df):
     print(top_missing.to_string())
 
     df["is_active"] = df["end_date"].fillna("").str.strip() == ""
-    active_missing = df.query("documentation_missing and is_active").shape[0]
-    ended_missing = df.query("documentation_missing and not is_active").shape[0]
+    active_missing = int((df["documentation_missing"] & df["is_active"]).sum())
+    ended_missing = int(missing_count) - active_missing
 
     print(f"\nActive endpoints missing documentation: {active_missing}")
     print(f"Ended endpoints missing documentation: {ended_missing}")
@@ -125,7 +121,7 @@ def save_results(df, output_dir):
     os.makedirs(output_dir, exist_ok=True)
     #filtered = df.query("documentation_missing and is_active")
     output_path = os.path.join(output_dir, "all_endpoints_and_documentation_urls.csv")
-    df.to_csv(output_path, index=False)
+    write_csv(df, output_path)
     print(f"CSV saved: {output_path}")
 
 def main():
@@ -1,47 +1,66 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import argparse
 import os
-from utils import read_csv_with_retry
+from concurrent.futures import ThreadPoolExecutor
+from utils import read_csv_arrow, write_csv
+
+TABLE_URL = "https://datasette.planning.data.gov.uk/digital-land/{table}.csv?_stream=on"
+
+# Columns read from each table
+TABLE_COLUMNS = {
+    "endpoint": {"endpoint": pa.string(), "end_date": pa.string(), "endpoint_url": pa.string()},
+    "source": {"endpoint": pa.string(), "source": pa.string(), "collection": pa.string(), "organisation": pa.string()},
+    "organisation": {"name": pa.string(), "reference": pa.string(), "end_date": pa.string()},
+    "resource_endpoint": {"endpoint": pa.string(), "resource": pa.string()},
+    "resource_dataset": {"dataset": pa.string(), "resource": pa.string()},
+    "provision": {"dataset": pa.string(), "organisation": pa.string()},
+}
+
+def fetch_tables():
+    """
+    Downloads the Datasette tables concurrently, as each is an independent network-bound fetch.
+    """
+    with ThreadPoolExecutor(max_workers=len(TABLE_COLUMNS)) as executor:
+        futures = {
+            table: executor.submit(read_csv_arrow, TABLE_URL.format(table=table), columns)
+            for table, columns in TABLE_COLUMNS.items()
+        }
+    return {table: future.result() for table, future in futures.items()}
 
 def endpoint_provisions_check(output_dir, include_pdf):
-    # Fetch and filter Endpoint table
-    endpoint_url = "https://datasette.planning.data.gov.uk/digital-land/endpoint.csv?_stream=on"
-    df0 = read_csv_with_retry(endpoint_url, low_memory=False)
-    df0 = df0[df0['end_date'].isna()]  # Keep only active endpoints
-    df_endpoint = df0[["endpoint", "end_date", "endpoint_url"]].copy()
-
-    # Fetch and process Source table
-    source_url = "https://datasette.planning.data.gov.uk/digital-land/source.csv?_stream=on"
-    df1 = read_csv_with_retry(source_url, low_memory=False)
-    df1["organisation_ref"] = df1["organisation"].str.replace(r"^.*?:", "", regex=True).astype(str)
-    df_source = df1[["endpoint", "source", "collection","organisation_ref"]].copy()
-
-    # Fetch and filter Organisation table
-    org_url = "https://datasette.planning.data.gov.uk/digital-land/organisation.csv?_stream=on"
-    df2 = read_csv_with_retry(org_url, low_memory=False)
+    tables = fetch_tables()
+
+    # Filter Endpoint table
+    df0 = tables["endpoint"]
+    # Keep only active endpoints
+    df_endpoint = df0.loc[df0['end_date'].isna(), ["endpoint", "end_date", "endpoint_url"]]
+
+    # Process Source table
+    df1 = tables["source"]
+    df1["organisation_ref"] = df1["organisation"].str.split(":", n=1).str[-1].astype(str)
+    df_source = df1[["endpoint", "source", "collection","organisation_ref"]]
+
+    # Filter Organisation table
+    df2 = tables["organisation"]
     df2 = df2[df2['end_date'].isna()]
-    df2["reference"] = df2["reference"].astype(str)
-    df_org = df2[["name", "reference"]].copy()
-    df_org.rename(columns={"name": "organisation", "reference": "organisation_ref"}, inplace=True)
-
-    # Fetch and deduplicate Resource_endpoint table
-    resource_endpoint_url = "https://datasette.planning.data.gov.uk/digital-land/resource_endpoint.csv?_stream=on"
-    df3 = read_csv_with_retry(resource_endpoint_url, low_memory=False)
-    df_resource_endpoint = df3[["endpoint", "resource"]].drop_duplicates(subset="endpoint", keep="last")
-
-    # Fetch and deduplicate Resource_dataset table
-    resource_dataset_url = "https://datasette.planning.data.gov.uk/digital-land/resource_dataset.csv?_stream=on"
-    df4 = read_csv_with_retry(resource_dataset_url, low_memory=False)
-    df_resource_dataset = df4[["dataset", "resource"]].drop_duplicates(subset="resource", keep="last")
-
-    # Fetch and process Provisions table
-    provisions_url = "https://datasette.planning.data.gov.uk/digital-land/provision.csv?_stream=on"
-    df5 = read_csv_with_retry(provisions_url, low_memory=False)
-    df5["organisation"] = df5["organisation"].str.replace(r"^.*?:", "", regex=True).astype(str)
-    df_provisions = df5[["dataset", "organisation"]].copy()
-    df_provisions.rename(columns={"organisation": "organisation_ref"}, inplace=True)
-    df_provisions = df_provisions.merge(df_org, on="organisation_ref", how="left")
-    df_provisions.drop(columns="organisation_ref", inplace=True)
+    df_org = df2[["name", "reference"]].rename(columns={"name": "organisation", "reference": "organisation_ref"})
+    df_org["organisation_ref"] = df_org["organisation_ref"].astype(str)
+
+    # Deduplicate Resource_endpoint table
+    df3 = tables["resource_endpoint"]
+    df_resource_endpoint = df3[["endpoint", "resource"]].groupby("endpoint", sort=False, dropna=False).tail(1)
+
+    # Deduplicate Resource_dataset table
+    df4 = tables["resource_dataset"]
+    df_resource_dataset = df4[["dataset", "resource"]].groupby("resource", sort=False, dropna=False).tail(1)
+
+    # Process Provisions table
+    df5 = tables["provision"]
+    df5["organisation"] = df5["organisation"].str.split(":", n=1).str[-1].astype(str)
+    df_provisions = df5[["dataset", "organisation"]].rename(columns={"organisation": "organisation_ref"})
+    df_provisions = df_provisions.merge(df_org, on="organisation_ref", how="left").drop(columns="organisation_ref")
 
     # Merge Endpoint with Source and Organisation
     df_ep_org = df_endpoint.merge(df_source, on="endpoint", how="left")
@@ -65,22 +84,23 @@ def endpoint_provisions_check(output_dir, include_pdf):
     df_missing = df_full[df_full["_merge"] == "left_only"].drop(columns=["_merge", "end_date"])
 
     # Separate PDF rows
-    pdf_mask = df_missing["endpoint_url"].fillna("").str.lower().str.endswith(".pdf")
-    df_pdfs = df_missing[pdf_mask]
-    df_non_pdfs = df_missing[~pdf_mask]
+    # Case-insensitive suffix match in a single Arrow kernel, without building a lower-cased copy
+    pdf_mask = pc.ends_with(
+        pa.array(df_missing["endpoint_url"], type=pa.string(), from_pandas=True), ".pdf", ignore_case=True
+    ).fill_null(False).to_numpy(zero_copy_only=False)
 
     # Save PDFs separately
     pdf_path = os.path.join(output_dir, "flag_endpoints_pdf_only.csv")
-    df_pdfs.to_csv(pdf_path, index=False)
+    write_csv(df_missing[pdf_mask], pdf_path)
 
-    # Save main CSV (either with or without PDFs)
+    # Save main CSV (either with or without PDFs); the non-PDF subset is only built when needed
     if include_pdf:
         final_output = df_missing
     else:
-        final_output = df_non_pdfs
+        final_output = df_missing[~pdf_mask]
 
     csv_path = os.path.join(output_dir, "flag_endpoints_no_provision.csv")
-    final_output.to_csv(csv_path, index=False)
+    write_csv(final_output, csv_path)
 
 def parse_args():
     """
@@ -9,62 +9,76 @@ Usage:
 
 import os
 import argparse
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import requests
-from utils import get_http_session, read_csv_with_retry
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from utils import read_csv_arrow, write_csv
+
+# URL probes are network-bound, so classify rows on a thread pool
+MAX_WORKERS = 32
+
+# One pooled session for all probes so repeat hosts reuse connections; sized for every worker
+# and without retries, as a failed probe is itself the signal
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+SESSION.mount("http://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+# Document extensions, in the order they are checked
+EXT_LABELS = ["pdf", "doc", "docx", "xls", "xlsx", "ppt", "pptx"]
 
 def is_pdf_url(url):
     """Check if URL points to a PDF by sending a HEAD request and inspecting Content-Type."""
     try:
-        response = requests.head(url, allow_redirects=True, timeout=5)
+        response = SESSION.head(url, allow_redirects=True, timeout=5)
         content_type = response.headers.get("Content-Type", "").lower()
         return "application/pdf" in content_type
     except:
         return False
 
-def fetch_text_content(url):
-    """Fetch and return lowercased plain text content of a URL (used for WFS error detection)."""
+def fetch_response(url):
+    """GET a URL once so its body can be checked for both auth and WFS errors; None if the request fails."""
     try:
-        r = requests.get(url, timeout=8)
-        if r.status_code == 200:
-            return r.text.lower()
-        return ""
+        return SESSION.get(url, timeout=8)
     except:
-        return ""
+        return None
 
-def classify_issue(row):
+def classify_by_extension(lowered):
     """
-    Classify each row by examining the endpoint URL and exception content.
-    Returns a tuple (group, details) with the error category and advice.
+    Classify lower-cased endpoint URLs by file extension or slug, as whole-column string matches.
+    Returns (group, details) object arrays; group is None where no rule matched.
     """
-    url = str(row.get("endpoint_url") or "").strip()
-    exc = str(row.get("exception") or "").lower()
-
-    ext_map = {
-        ".pdf": "pdf", ".doc": "doc", ".docx": "docx",
-        ".xls": "xls", ".xlsx": "xlsx", ".ppt": "ppt", ".pptx": "pptx"
-    }
-
-    if ".zip" in url.lower():
-        return ("zipped file", "file needs to be unzipped first")
-
-    for ext, label in ext_map.items():
-        if ext in url.lower():
-            if label == "xls":
-                return ("XLS files", "Possible issues with opening xls file")
-            return ("active document links", f"{label} file in URL")
-
-    for label in ext_map.values():
-        if f"-{label}" in url.lower():
+    conditions = [lowered.str.contains(".zip", regex=False).to_numpy(dtype=bool)]
+    groups = ["zipped file"]
+    details = ["file needs to be unzipped first"]
+    # Earlier rules win, so extensions are checked before slugs and in EXT_LABELS order
+    for template, detail in ((".{}", "{} file in URL"), ("-{}", "{} inferred from slug")):
+        for label in EXT_LABELS:
+            conditions.append(lowered.str.contains(template.format(label), regex=False).to_numpy(dtype=bool))
             if label == "xls":
-                return ("XLS files", "Possible issues with opening xls file")
-            return ("active document links", f"{label} inferred from slug")
-
+                groups.append("XLS files")
+                details.append("Possible issues with opening xls file")
+            else:
+                groups.append("active document links")
+                details.append(detail.format(label))
+    # Object arrays, so probe results of any length can be filled in later
+    group = np.select(conditions, groups, default=None).astype(object)
+    detail = np.select(conditions, details, default="").astype(object)
+    return group, detail
+
+def classify_issue(url, is_wfs):
+    """
+    Classify an endpoint URL that matched no extension rule by probing the server.
+    is_wfs flags URLs naming a WFS service or GetFeature request, so their error bodies are checked.
+    Returns a tuple (group, details) with the error category and advice.
+    """
     if is_pdf_url(url):
         return ("active document links", "confirmed via Content-Type check")
 
+    r = fetch_response(url)
     try:
-        r = requests.get(url, timeout=8)
         if r.headers.get("Content-Type", "").lower().startswith("application/json"):
             json_body = r.json()
             error = json_body.get("error", {})
@@ -75,8 +89,8 @@ def classify_issue(row):
     except:
         pass
 
-    if "getfeature" in url.lower() or "wfs" in url.lower():
-        text = fetch_text_content(url)
+    if is_wfs:
+        text = r.text.lower() if r is not None and r.status_code == 200 else ""
         if "serviceexception" in text and "feature" in text:
             return ("wfs error", "Likely invalid typeName - check WFS GetCapabilities")
 
@@ -91,14 +105,21 @@ def main(output_dir):
         "where+status%3D'failed'+and+(r.end_date+is+null+or+r.end_date%3D'')+"
         "order+by+r.start_date+desc+limit+1000"
     )
-    df_failed = read_csv_with_retry(csv_url)
+    df_failed = read_csv_arrow(csv_url, {"resource": pa.string()})
 
-    # Supporting metadata
-    df_endpoint = read_csv_with_retry("https://datasette.planning.data.gov.uk/digital-land/endpoint.csv?_stream=on", low_memory=False)[["endpoint", "endpoint_url"]]
-    df_resource_endpoint = read_csv_with_retry("https://datasette.planning.data.gov.uk/digital-land/resource_endpoint.csv?_stream=on", low_memory=False)[["endpoint", "resource"]]
-    df_source_raw = read_csv_with_retry("https://datasette.planning.data.gov.uk/digital-land/source.csv?_stream=on", low_memory=False)
-    df_source_raw["organisation_ref"] = df_source_raw["organisation"].str.replace(r"^.*?:", "", regex=True).astype(str)
-    df_source = df_source_raw[["endpoint", "source", "collection", "organisation_ref"]]
+    # Supporting metadata; only the columns used in the joins and output are decoded
+    df_endpoint = read_csv_arrow(
+        "https://datasette.planning.data.gov.uk/digital-land/endpoint.csv?_stream=on",
+        {"endpoint": pa.string(), "endpoint_url": pa.string()},
+    )
+    df_resource_endpoint = read_csv_arrow(
+        "https://datasette.planning.data.gov.uk/digital-land/resource_endpoint.csv?_stream=on",
+        {"endpoint": pa.string(), "resource": pa.string()},
+    )
+    df_source = read_csv_arrow(
+        "https://datasette.planning.data.gov.uk/digital-land/source.csv?_stream=on",
+        {"endpoint": pa.string(), "source": pa.string(), "collection": pa.string()},
+    )
 
     # Join metadata
     df_resource_endpoint = df_resource_endpoint.drop_duplicates(subset="resource", keep="last")
@@ -107,8 +128,27 @@ def main(output_dir):
     df = df.merge(df_endpoint, on="endpoint", how="left")
     df = df.merge(df_source, on="endpoint", how="left")
 
-    # Classify
-    df[["group", "details"]] = df.apply(lambda row: pd.Series(classify_issue(row)), axis=1)
+    # Classify each distinct URL once (many failed resources share an endpoint)
+    codes, unique_urls = pd.factorize(df["endpoint_url"])
+    # Strip and lower-case every URL once, rather than per rule
+    urls = pd.Series(unique_urls, dtype=object).str.strip()
+    lowered = urls.str.lower()
+    group, details = classify_by_extension(lowered)
+    is_wfs = (
+        lowered.str.contains("getfeature", regex=False) | lowered.str.contains("wfs", regex=False)
+    ).to_numpy(dtype=bool)
+
+    # Only URLs no extension rule matched need HTTP probes, which are network-bound, so run them concurrently
+    unmatched = np.flatnonzero(pd.isna(group))
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        probed = list(executor.map(classify_issue, urls.to_numpy()[unmatched], is_wfs[unmatched]))
+    for i, (g, d) in zip(unmatched, probed):
+        group[i] = g
+        details[i] = d
+
+    # Rows without an endpoint URL (code -1) take the trailing unclassified entry
+    df["group"] = np.append(group, None)[codes]
+    df["details"] = np.append(details, "")[codes]
 
     # Manual patches
     force_pdf_urls = [
@@ -127,7 +167,7 @@ def main(output_dir):
     df_out = df[[
         "resource", "source", "collection", "endpoint_url", "group", "details", "recommend_retirement"
     ]]
-    df_out.to_csv(output_path, index=False)
+    write_csv(df_out, output_path)
     print(f"Saved {len(df_out)} rows to {output_path}")
 
 if __name__ == "__main__":
@@ -12,7 +12,7 @@ from urllib.request import urlretrieve
 from pathlib import Path
 import argparse
 import os
-from utils import get_http_session
+from utils import get_datasette_query, get_pages
 
 logger = logging.getLogger(__name__)
 
@@ -38,28 +38,6 @@ def parse_args():
     )
     return parser.parse_args()
 
-def get_datasette_query(db, sql, filter=None, url="https://datasette.planning.data.gov.uk"):
-    """
-    Executes an SQL query against a Datasette database and returns the result as a DataFrame.
-
-    Args:
-        db (str): The database name (e.g. 'digital-land')
-        sql (str): SQL query string
-        filter (dict, optional): Additional query parameters
-        url (str): Base Datasette URL
-
-    Returns:
-        pd.DataFrame | None: Query result as a DataFrame or None on failure
-    """
-    url = f"{url}/{db}.json"
-    params = {"sql": sql, "_shape": "array", "_size": "max"}
-    if filter:
-        params.update(filter)
-    http = get_http_session()
-    resp = http.get(url, params=params)
-    resp.raise_for_status()
-    return pd.DataFrame.from_dict(resp.json())
-
 def get_provisions(selected_cohorts, all_cohorts):
     """
     Queries the Datasette 'provision' table for expected datasets for selected cohorts.
@@ -133,6 +111,17 @@ ALL_DATASETS = [
     "tree",
 ]
 
+# Key columns of the column field summary held as categoricals
+CATEGORY_COLUMNS = [
+    "dataset",
+    "cohort",
+    "organisation",
+    "organisation_name",
+    "endpoint",
+    "resource",
+    "licence",
+]
+
 # Configs that are passed to the front end for the filters
 DATASET_TYPES = [
     {"name": "Spatial", "id": "spatial"},
@@ -151,19 +140,13 @@ COHORTS = [
 ]
 
 
-def get_column_field_summary(dataset_clause, offset):
-    """
-    Retrieves endpoint dataset resource summaries for datasets matching the clause.
+# Datasette returns at most this many rows per query, so larger results are paged
+PAGE_SIZE = 1000
 
-    Args:
-        dataset_clause (str): SQL filter for datasets (e.g. "edrs.pipeline = 'tree'")
-        offset (int): Row offset for pagination
+# Pages are independent once the row count is known, so fetch them concurrently
+MAX_WORKERS = 8
 
-    Returns:
-        pd.DataFrame: Results from `endpoint_dataset_resource_summary` joined with endpoint metadata.
-    """
-    sql = f"""
-    SELECT edrs.*, rle.licence
+COLUMN_FIELD_FROM = """
     FROM endpoint_dataset_resource_summary AS edrs
     LEFT JOIN (
         SELECT endpoint, licence, dataset
@@ -176,8 +159,66 @@ def get_column_field_summary(dataset_clause, offset):
     WHERE edrs.resource != ''
     and eds.endpoint_end_date=''
     and ({dataset_clause})
-    limit 1000 offset {offset}
+"""
+
+ISSUE_SUMMARY_FROM = """
+    from endpoint_dataset_issue_type_summary edrs
+    where ({dataset_clause})
+"""
+
+
+def count_rows(from_clause, dataset_clause):
     """
+    Counts the rows a paged query will return, so every page can be requested at once.
+
+    Args:
+        from_clause (str): FROM/WHERE template shared with the paged query.
+        dataset_clause (str): SQL filter for datasets.
+
+    Returns:
+        int: Number of matching rows.
+    """
+    sql = "select count(*) as row_count" + from_clause.format(dataset_clause=dataset_clause)
+    return int(get_datasette_query("performance", sql)["row_count"].iloc[0])
+
+
+def get_all_pages(get_page, from_clause, dataset_clause):
+    """
+    Fetches every page of a paged query concurrently and concatenates them in offset order.
+
+    Args:
+        get_page (callable): Page fetcher taking (dataset_clause, offset).
+        from_clause (str): FROM/WHERE template used by get_page, for the row count.
+        dataset_clause (str): SQL filter for datasets.
+
+    Returns:
+        pd.DataFrame: All rows of the query.
+    """
+    pages = get_pages(
+        lambda offset: get_page(dataset_clause, offset),
+        count_rows(from_clause, dataset_clause),
+        PAGE_SIZE,
+        MAX_WORKERS,
+    )
+    return pd.concat(pages)
+
+
+def get_column_field_summary(dataset_clause, offset):
+    """
+    Retrieves endpoint dataset resource summaries for datasets matching the clause.
+
+    Args:
+        dataset_clause (str): SQL filter for datasets (e.g. "edrs.pipeline = 'tree'")
+        offset (int): Row offset for pagination
+
+    Returns:
+        pd.DataFrame: Results from `endpoint_dataset_resource_summary` joined with endpoint metadata.
+    """
+    sql = (
+        "SELECT edrs.*, rle.licence"
+        + COLUMN_FIELD_FROM.format(dataset_clause=dataset_clause)
+        + f"limit {PAGE_SIZE} offset {offset}"
+    )
     column_field_df = get_datasette_query("performance", sql)
 
     return column_field_df
@@ -194,15 +235,36 @@ def get_issue_summary(dataset_clause, offset):
     Returns:
         pd.DataFrame: Issue summary from Datasette.
     """
-    sql = f"""
-    select  * from endpoint_dataset_issue_type_summary edrs
-    where ({dataset_clause})
-    limit 1000 offset {offset}
-    """
+    sql = (
+        "select *"
+        + ISSUE_SUMMARY_FROM.format(dataset_clause=dataset_clause)
+        + f"limit {PAGE_SIZE} offset {offset}"
+    )
     issue_summary_df = get_datasette_query("performance", sql)
     return issue_summary_df
 
 
+def filter_spec_fields(column_field_df, column, spec_fields):
+    """
+    Splits a ';'-separated field list column and keeps only the fields in each row's dataset specification.
+
+    Args:
+        column_field_df (pd.DataFrame): Column field summary with 'dataset' and the field list column.
+        column (str): Name of the ';'-separated field list column (e.g. 'mapping_field').
+        spec_fields (pd.MultiIndex): Valid (dataset, field) pairs from the specification.
+
+    Returns:
+        pd.Series: A list of specification fields per row, in their original order.
+    """
+    # One row per (dataset, field) so membership is a single hashed lookup instead of a per-row filter
+    exploded = pd.DataFrame(
+        {"dataset": column_field_df["dataset"], "field": column_field_df[column].fillna("").str.split(";")}
+    ).explode("field")
+    in_spec = pd.MultiIndex.from_frame(exploded).isin(spec_fields)
+    kept = exploded.loc[in_spec, "field"].groupby(level=0, sort=False).agg(list)
+    return kept.reindex(column_field_df.index).map(lambda fields: fields if isinstance(fields, list) else [])
+
+
 def get_odp_conformance_summary(dataset_types, cohorts, specification_path):
     """
     Main function that combines provisions, endpoints, and issues to calculate conformance scores.
@@ -236,17 +298,7 @@ def get_odp_conformance_summary(dataset_types, cohorts, specification_path):
 
     # Download column field summary table
     # Use pagination in case rows returned > 1000
-    pagination_incomplete = True
-    offset = 0
-    column_field_df_list = []
-    while pagination_incomplete:
-        column_field_df = get_column_field_summary(dataset_clause, offset)
-        column_field_df_list.append(column_field_df)
-        pagination_incomplete = len(column_field_df) == 1000
-        offset += 1000
-    if len(column_field_df_list) == 0:
-        return {"params": params, "rows": [], "headers": []}
-    column_field_df = pd.concat(column_field_df_list)
+    column_field_df = get_all_pages(get_column_field_summary, COLUMN_FIELD_FROM, dataset_clause)
       
     column_field_df = pd.merge(
         column_field_df, provision_df, on=["organisation", "cohort"], how="left"
@@ -255,112 +307,56 @@ def get_odp_conformance_summary(dataset_types, cohorts, specification_path):
     # Optional: Fill missing names or dates (if helpful for display/export)
     column_field_df["organisation_name"] = column_field_df["organisation_name"].fillna("Unknown")
     column_field_df["cohort_start_date"] = column_field_df["cohort_start_date"].fillna("")
+    # Repeated key columns as categoricals, so grouping and lookups work on integer codes
+    column_field_df = column_field_df.astype({column: "category" for column in CATEGORY_COLUMNS})
 
     # Download issue summary table
-    pagination_incomplete = True
-    offset = 0
-    issue_df_list = []
-    while pagination_incomplete:
-        issue_df = get_issue_summary(dataset_clause, offset)
-        issue_df_list.append(issue_df)
-        pagination_incomplete = len(issue_df) == 1000
-        offset += 1000
-    issue_df = pd.concat(issue_df_list)
+    issue_df = get_all_pages(get_issue_summary, ISSUE_SUMMARY_FROM, dataset_clause)
+    issue_df = issue_df.astype({"dataset": "category", "resource": "category", "severity": "category"})
 
     dataset_field_df = get_dataset_field(specification_path)
 
     # remove fields that are auto-created in the pipeline from the dataset_field file to avoid mis-counting
     # ("entity", "organisation", "prefix", "point" for all but tree, and "entity", "organisation", "prefix" for tree)
+    auto_created = [
+        (dataset, field)
+        for dataset in dataset_field_df["dataset"].unique()
+        for field in ["entity", "organisation", "prefix", "point"]
+        if not (dataset == "tree" and field == "point")
+    ]
     dataset_field_df = dataset_field_df[
-        (dataset_field_df["dataset"] != "tree")
-        & (
-            ~dataset_field_df["field"].isin(
-                ["entity", "organisation", "prefix", "point"]
-            )
-        )
-        | (dataset_field_df["dataset"] == "tree")
-        & (~dataset_field_df["field"].isin(["entity", "organisation", "prefix"]))
+        ~pd.MultiIndex.from_frame(dataset_field_df[["dataset", "field"]]).isin(auto_created)
     ]
 
     # Filter out fields not in spec
-    column_field_df["mapping_field"] = column_field_df.replace({'"', ""}).apply(
-        lambda row: [
-            field
-            for field in (
-                row["mapping_field"].split(";") if row["mapping_field"] else ""
-            )
-            if field
-            in dataset_field_df[dataset_field_df["dataset"] == row["dataset"]][
-                "field"
-            ].values
-        ],
-        axis=1,
-    )
-    column_field_df["non_mapping_field"] = column_field_df.replace({'"', ""}).apply(
-        lambda row: [
-            field
-            for field in (
-                row["non_mapping_field"].split(";") if row["non_mapping_field"] else ""
-            )
-            if field
-            in dataset_field_df[dataset_field_df["dataset"] == row["dataset"]][
-                "field"
-            ].values
-        ],
-        axis=1,
-    )
+    spec_fields = pd.MultiIndex.from_frame(dataset_field_df[["dataset", "field"]])
+    column_field_df["mapping_field"] = filter_spec_fields(column_field_df, "mapping_field", spec_fields)
+    column_field_df["non_mapping_field"] = filter_spec_fields(column_field_df, "non_mapping_field", spec_fields)
 
     # Map entity errors to reference field
     issue_df["field"] = issue_df["field"].replace("entity", "reference")
     # Filter out issues for fields not in dataset field (specification)
-    issue_df["field"] = issue_df.apply(
-        lambda row: (
-            row["field"]
-            if row["field"]
-            in dataset_field_df[dataset_field_df["dataset"] == row["dataset"]][
-                "field"
-            ].values
-            else None
-        ),
-        axis=1,
+    issue_df["field"] = issue_df["field"].where(
+        pd.MultiIndex.from_frame(issue_df[["dataset", "field"]]).isin(spec_fields), None
     )
 
     # Create field matched and field supplied scores
-    column_field_df["field_matched"] = column_field_df.apply(
-        lambda row: len(row["mapping_field"]) if row["mapping_field"] else 0, axis=1
-    )
-    column_field_df["field_supplied"] = column_field_df.apply(
-        lambda row: row["field_matched"]
-        + (len(row["non_mapping_field"]) if row["non_mapping_field"] else 0),
-        axis=1,
-    )
-    column_field_df["field"] = column_field_df.apply(
-        lambda row: len(
-            dataset_field_df[dataset_field_df["dataset"] == row["dataset"]]
-        ),
-        axis=1,
+    column_field_df["field_matched"] = column_field_df["mapping_field"].str.len()
+    column_field_df["field_supplied"] = (
+        column_field_df["field_matched"] + column_field_df["non_mapping_field"].str.len()
     )
+    field_counts = dataset_field_df.groupby("dataset").size()
+    column_field_df["field"] = field_counts.reindex(column_field_df["dataset"]).fillna(0).astype(int).to_numpy()
 
-    # Check for fields which have error issues
-    results_issues = [
-        issue_df[
-            (issue_df["resource"] == r["resource"]) & (issue_df["severity"] == "error")
-        ]
-        for index, r in column_field_df.iterrows()
-    ]
-    results_issues_df = pd.concat(results_issues)
+    # Count error issues per resource
+    error_counts = issue_df.loc[issue_df["severity"] == "error"].groupby("resource", observed=True).size()
 
     # Create fields with errors column
-    column_field_df["field_errors"] = column_field_df.apply(
-        lambda row: len(
-            results_issues_df[row["resource"] == results_issues_df["resource"]]
-        ),
-        axis=1,
-    )
+    column_field_df["field_errors"] = error_counts.reindex(column_field_df["resource"]).fillna(0).astype(int).to_numpy()
 
     # Create endpoint ID column to track multiple endpoints per organisation-dataset
     column_field_df["endpoint_no."] = (
-        column_field_df.groupby(["organisation", "dataset"]).cumcount() + 1
+        column_field_df.groupby(["organisation", "dataset"], observed=True).cumcount() + 1
     )
     column_field_df["endpoint_no."] = column_field_df["endpoint_no."].astype(str)
 
@@ -378,7 +374,8 @@ def get_odp_conformance_summary(dataset_types, cohorts, specification_path):
                 "resource",
                 "latest_log_entry_date",
                 "cohort_start_date",
-            ]
+            ],
+            observed=True,
         )
         .agg(
             {
@@ -397,21 +394,10 @@ def get_odp_conformance_summary(dataset_types, cohorts, specification_path):
     final_count["field_error_free"] = final_count["field_error_free"].replace(-1, 0)
 
     # add string fields for [n fields]/[total fields] style counts
-    final_count["field_supplied_count"] = (
-        final_count["field_supplied"].astype(int).map(str)
-        + "/"
-        + final_count["field"].map(str)
-    )
-    final_count["field_error_free_count"] = (
-        final_count["field_error_free"].astype(int).map(str)
-        + "/"
-        + final_count["field"].map(str)
-    )
-    final_count["field_matched_count"] = (
-        final_count["field_matched"].astype(int).map(str)
-        + "/"
-        + final_count["field"].map(str)
-    )
+    # the "/[total fields]" suffix is shared, so format it once
+    field_total = "/" + final_count["field"].astype(str)
+    for count_column in ["field_supplied", "field_error_free", "field_matched"]:
+        final_count[f"{count_column}_count"] = final_count[count_column].astype(int).astype(str) + field_total
 
     # create % columns
     final_count["field_supplied_pct"] = (
@@ -479,15 +465,15 @@ def get_odp_conformance_summary(dataset_types, cohorts, specification_path):
         )
     ]
 
+    # Format and classify a whole column at a time, then zip the cells into rows
+    cell_texts = [make_pretty_column(final_count[column]) for column in out_cols]
+    cell_classes = [background_class_column(final_count[column]) for column in out_cols]
     rows = [
         [
-            {
-                "text": make_pretty(cell),
-                "classes": "reporting-table-cell " + get_background_class(cell),
-            }
-            for cell in r
+            {"text": text, "classes": "reporting-table-cell " + css_class}
+            for text, css_class in zip(texts, classes)
         ]
-        for index, r in final_count[out_cols].iterrows()
+        for texts, classes in zip(zip(*cell_texts), zip(*cell_classes))
     ]
 
     # Calculate overview stats
@@ -498,43 +484,20 @@ def get_odp_conformance_summary(dataset_types, cohorts, specification_path):
         "tree",
         "tree-preservation-zone",
     ]
-    overview_stats_df = pd.DataFrame()
-    overview_stats_df["dataset"] = overview_datasets
-    overview_stats_df = overview_stats_df.merge(
-        final_count[["dataset", "field_supplied_pct"]][
-            final_count["field_supplied_pct"] < 0.5
-        ]
-        .groupby("dataset")
-        .count(),
-        on="dataset",
-        how="left",
-    ).rename(columns={"field_supplied_pct": "< 50%"})
-    overview_stats_df = overview_stats_df.merge(
-        final_count[["dataset", "field_supplied_pct"]][
-            (final_count["field_supplied_pct"] >= 0.5)
-            & (final_count["field_supplied_pct"] < 0.8)
-        ]
-        .groupby("dataset")
-        .count(),
-        on="dataset",
-        how="left",
-    ).rename(columns={"field_supplied_pct": "50% - 80%"})
-    overview_stats_df = overview_stats_df.merge(
-        final_count[["dataset", "field_supplied_pct"]][
-            final_count["field_supplied_pct"] >= 0.8
-        ]
-        .groupby("dataset")
-        .count(),
-        on="dataset",
-        how="left",
-    ).rename(columns={"field_supplied_pct": "> 80%"})
-    overview_stats_df.replace(np.nan, 0, inplace=True)
-    overview_stats_df = overview_stats_df.astype(
-        {
-            "< 50%": int,
-            "50% - 80%": int,
-            "> 80%": int,
-        }
+    # Bucket field_supplied_pct once and count per dataset; an infinite pct (no spec fields) counts as > 80%
+    supplied_bands = ["< 50%", "50% - 80%", "> 80%"]
+    supplied_band = pd.cut(
+        final_count["field_supplied_pct"].clip(upper=1.0),
+        bins=[-np.inf, 0.5, 0.8, np.inf],
+        right=False,
+        labels=supplied_bands,
+    )
+    overview_stats_df = (
+        pd.crosstab(final_count["dataset"], supplied_band)
+        .reindex(index=overview_datasets, columns=supplied_bands, fill_value=0)
+        .rename_axis(index="dataset", columns=None)
+        .reset_index()
+        .astype({band: int for band in supplied_bands})
     )
 
     stats_headers = [
@@ -548,7 +511,7 @@ def get_odp_conformance_summary(dataset_types, cohorts, specification_path):
     ]
     stats_rows = [
         [{"text": cell, "classes": "reporting-table-cell"} for cell in r]
-        for index, r in overview_stats_df.iterrows()
+        for r in overview_stats_df.itertuples(index=False)
     ]
     return {
         "headers": headers,
@@ -577,23 +540,43 @@ def make_pretty(text):
         return text.replace("_", " ").replace("pct", "%").replace("count", "")
     return text
 
-def get_background_class(text):
+def make_pretty_column(values):
     """
-    Assigns a background class based on the numeric value (for HTML/visual display).
+    Applies make_pretty to every value of a column at once.
 
     Args:
-        text (float or str): A percentage float value (0.0 to 1.0)
+        values (pd.Series): A float percentage column or a text column.
 
     Returns:
-        str: CSS class name string based on value grouping (e.g., 'reporting-90-100-background').
+        pd.Series: Human-readable formatted strings.
     """
-    if type(text) is float:
-        group = int((text * 100) / 10)
-        if group == 10:
-            return "reporting-100-background"
-        else:
-            return "reporting-" + str(group) + "0-" + str(group + 1) + "0-background"
-    return ""
+    if pd.api.types.is_float_dtype(values):
+        return (100 * values).round().astype(int).astype(str) + "%"
+    text = values.astype(str)
+    has_underscore = text.str.contains("_", regex=False)
+    pretty = (
+        text.str.replace("_", " ", regex=False)
+        .str.replace("pct", "%", regex=False)
+        .str.replace("count", "", regex=False)
+    )
+    return pretty.where(has_underscore, text)
+
+def background_class_column(values):
+    """
+    Assigns background classes to a column of percentage values (for HTML/visual display).
+
+    Args:
+        values (pd.Series): A float percentage column (0.0 to 1.0) or a text column.
+
+    Returns:
+        pd.Series: CSS class name strings based on value grouping (e.g., 'reporting-90-100-background');
+            empty for non-float columns.
+    """
+    if not pd.api.types.is_float_dtype(values):
+        return pd.Series("", index=values.index)
+    group = ((values * 100) / 10).astype(int)
+    classes = "reporting-" + group.astype(str) + "0-" + (group + 1).astype(str) + "0-background"
+    return classes.mask(group == 10, "reporting-100-background")
 
 def get_dataset_field(specification_path):
     """
@@ -604,17 +587,15 @@ def get_dataset_field(specification_path):
     """
     spec_path = Path(specification_path)  # Clean it up
     
-    specification_df = pd.read_csv(spec_path)
-    
-    rows = []
-    for index, row in specification_df.iterrows():
-        specification_dicts = json.loads(row["json"])
-        for dict in specification_dicts:
-            dataset = dict["dataset"]
-            fields = [field["field"] for field in dict["fields"]]
-            for field in fields:
-                rows.append({"dataset": dataset, "field": field})
-    return pd.DataFrame(rows)
+    specification_df = pd.read_csv(spec_path, usecols=["json"])
+
+    rows = [
+        (spec["dataset"], field["field"])
+        for blob in specification_df["json"]
+        for spec in json.loads(blob)
+        for field in spec["fields"]
+    ]
+    return pd.DataFrame(rows, columns=["dataset", "field"])
 
 if __name__ == "__main__":
     # Parse CLI args
@@ -7,7 +7,16 @@ of expected dataset performance per organisation and cohort.
 import os
 import pandas as pd
 import argparse
-from utils import get_http_session
+from utils import get_datasette_query, get_http_session, get_pages, write_csv
+
+# Datasette returns at most this many rows per query, so issue summaries are paged
+PAGE_SIZE = 1000
+
+# Pages are independent once the row count is known, so fetch them concurrently
+MAX_WORKERS = 8
+
+# One Session for every query, so pages fetched concurrently share pooled connections
+SESSION = get_http_session(pool_maxsize=MAX_WORKERS)
 
 # Dataset Definitions
 SPATIAL_DATASETS = [
@@ -24,27 +33,45 @@ DOCUMENT_DATASETS = [
 ]
 ALL_DATASETS = SPATIAL_DATASETS + DOCUMENT_DATASETS
 
-# Datasette Query Helper
-def get_datasette_query(db: str, sql: str, url="https://datasette.planning.data.gov.uk") -> pd.DataFrame:
-    """
-    Executes an SQL query against the specified Datasette database.
-
-    Args:
-        db (str): Datasette database name.
-        sql (str): SQL query string.
-        url (str): Base Datasette URL.
-
-    Returns:
-        pd.DataFrame: Resulting data as a DataFrame, or empty on failure.
-    """
-    full_url = f"{url}/{db}.json"
-    params = {"sql": sql, "_shape": "array", "_size": "max"}
-    http = get_http_session()
-    response = http.get(full_url, params=params)
-    response.raise_for_status()
-    return pd.DataFrame(response.json())
+# Explicit types for the issue summary columns, so every page has the same schema and
+# text is held in Arrow buffers rather than as Python objects. Dates are only passed
+# through to the output, so they stay as text.
+ISSUE_DTYPES = {
+    "organisation": "string[pyarrow]",
+    "cohort": "string[pyarrow]",
+    "dataset": "string[pyarrow]",
+    "pipeline": "string[pyarrow]",
+    "issue_type": "string[pyarrow]",
+    "severity": "string[pyarrow]",
+    "responsibility": "string[pyarrow]",
+    "count_issues": "Int64",
+    "collection": "string[pyarrow]",
+    "endpoint": "string[pyarrow]",
+    "endpoint_url": "string[pyarrow]",
+    "latest_exception": "string[pyarrow]",
+    "resource": "string[pyarrow]",
+    "latest_log_entry_date": "string[pyarrow]",
+    "endpoint_entry_date": "string[pyarrow]",
+    "endpoint_end_date": "string[pyarrow]",
+    "resource_start_date": "string[pyarrow]",
+    "resource_end_date": "string[pyarrow]",
+}
 
 # Provision Query
+PROVISIONS_SQL = """
+    SELECT
+        p.cohort,
+        p.organisation,
+        c.start_date AS cohort_start_date,
+        o.name AS organisation_name
+    FROM provision p
+    INNER JOIN cohort c ON c.cohort = p.cohort
+    INNER JOIN organisation o ON o.organisation = p.organisation
+    WHERE p.provision_reason = 'expected'
+      AND p.project = 'open-digital-planning'
+    GROUP BY p.organisation, p.cohort
+"""
+
 def get_provisions():
     """
     Retrieves all expected dataset provisions from the 'provision' table.
@@ -52,22 +79,22 @@ def get_provisions():
     Returns:
         pd.DataFrame: Provision records joined with cohort and organisation names.
     """
-    sql = """
-        SELECT
-            p.cohort,
-            p.organisation,
-            c.start_date AS cohort_start_date,
-            o.name AS organisation_name
-        FROM provision p
-        INNER JOIN cohort c ON c.cohort = p.cohort
-        INNER JOIN organisation o ON o.organisation = p.organisation
-        WHERE p.provision_reason = 'expected'
-          AND p.project = 'open-digital-planning'
-        GROUP BY p.organisation, p.cohort
-    """
-    return get_datasette_query("digital-land", sql)
+    return get_datasette_query("digital-land", PROVISIONS_SQL, SESSION)
 
 # Issue Query (Paged)
+# FROM/WHERE shared by the paged query and its row count, so the count includes any
+# rows the endpoint join adds
+ISSUE_TYPE_FROM = """
+    FROM endpoint_dataset_issue_type_summary edits
+    LEFT JOIN (
+        SELECT endpoint, end_date as endpoint_end_date,
+               entry_date as endpoint_entry_date,
+               latest_status, latest_exception
+        FROM endpoint_dataset_summary
+    ) eds ON edits.endpoint = eds.endpoint
+    {dataset_clause}
+"""
+
 def get_issue_type_chunk(dataset_clause, offset):
     """
     Retrieves a paged chunk of issue type summaries joined with endpoint metadata.
@@ -86,17 +113,27 @@ def get_issue_type_chunk(dataset_clause, offset):
             eds.endpoint_entry_date,
             eds.latest_status,
             eds.latest_exception
-        FROM endpoint_dataset_issue_type_summary edits
-        LEFT JOIN (
-            SELECT endpoint, end_date as endpoint_end_date,
-                   entry_date as endpoint_entry_date,
-                   latest_status, latest_exception
-            FROM endpoint_dataset_summary
-        ) eds ON edits.endpoint = eds.endpoint
-        {dataset_clause}
-        LIMIT 1000 OFFSET {offset}
+        {ISSUE_TYPE_FROM.format(dataset_clause=dataset_clause)}
+        LIMIT {PAGE_SIZE} OFFSET {offset}
+    """
+    df = get_datasette_query("performance", sql, SESSION)
+    return df.astype({c: t for c, t in ISSUE_DTYPES.items() if c in df.columns})
+
+def get_issue_type_count(dataset_clause):
     """
-    return get_datasette_query("performance", sql)
+    Counts the issue type summary rows matching the clause, so every page can be requested at once.
+
+    Args:
+        dataset_clause (str): SQL clause to filter datasets.
+
+    Returns:
+        int: Number of matching rows.
+    """
+    sql = f"""
+        SELECT COUNT(*) AS row_count
+        {ISSUE_TYPE_FROM.format(dataset_clause=dataset_clause)}
+    """
+    return int(get_datasette_query("performance", sql, SESSION)["row_count"].iloc[0])
 
 def get_full_issue_type_summary(datasets):
     """
@@ -108,18 +145,15 @@ def get_full_issue_type_summary(datasets):
     Returns:
         pd.DataFrame: Combined issue summary for all specified datasets.
     """
-    dataset_clause = "WHERE " + " OR ".join(f"edits.dataset = '{ds}'" for ds in datasets)
-    df_list = []
-    offset = 0
-    while True:
-        chunk = get_issue_type_chunk(dataset_clause, offset)
-        if chunk.empty:
-            break
-        df_list.append(chunk)
-        if len(chunk) < 1000:
-            break
-        offset += 1000
-    return pd.concat(df_list, ignore_index=True)
+    dataset_clause = "WHERE edits.dataset IN (" + ", ".join(f"'{ds}'" for ds in datasets) + ")"
+    df_list = get_pages(
+        lambda offset: get_issue_type_chunk(dataset_clause, offset),
+        get_issue_type_count(dataset_clause),
+        PAGE_SIZE,
+        MAX_WORKERS,
+    )
+    # Pages share one schema, so concatenating only appends the column buffers
+    return pd.concat(df_list, ignore_index=True, copy=False)
 
 # Main CSV Generator
 def generate_detailed_issue_csv(output_dir: str, dataset_type="all") -> str:
@@ -147,17 +181,21 @@ def generate_detailed_issue_csv(output_dir: str, dataset_type="all") -> str:
     issues = get_full_issue_type_summary(datasets)
 
     print("[INFO] Merging data...")
+    # Provisions are grouped by organisation and cohort, so each matches many issue rows
     merged = provisions.merge(
         issues.drop(columns=["organisation_name"], errors="ignore"),
         on=["organisation", "cohort"],
-        how="inner"
+        how="inner",
+        validate="one_to_many",
     )
 
     print("[INFO] Saving CSV...")
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, "odp_issue.csv")
-    merged[
-        [
+    write_csv(
+        merged,
+        output_path,
+        columns=[
             "organisation",
             "cohort",
             "organisation_name",
@@ -177,8 +215,8 @@ def generate_detailed_issue_csv(output_dir: str, dataset_type="all") -> str:
             "endpoint_end_date",
             "resource_start_date",
             "resource_end_date",
-        ]
-    ].to_csv(output_path, index=False)
+        ],
+    )
 
     print(f"[SUCCESS] CSV saved: {output_path} ({len(merged)} rows)")
     return output_path
@@ -12,7 +12,12 @@ The script:
 import os
 import pandas as pd
 import argparse
-from utils import get_http_session
+import pyarrow as pa
+import pyarrow.compute as pc
+from utils import get_datasette_query, get_http_session, read_csv_arrow, write_csv
+
+# One Session for every query, so the connection is reused between them
+SESSION = get_http_session()
 
 # Dataset to Pipeline Map
 ALL_PIPELINES = {
@@ -26,28 +31,63 @@ ALL_PIPELINES = {
     ],
 }
 
-# Datasette Query Helpers
-def get_datasette_query(db: str, sql: str, url="https://datasette.planning.data.gov.uk") -> pd.DataFrame:
-    """
-    Executes SQL against a Datasette database and returns the result as a DataFrame.
-
-    Args:
-        db (str): The name of the Datasette database (e.g., 'digital-land').
-        sql (str): SQL query string to run.
-        url (str): Base URL of the Datasette instance.
-
-    Returns:
-        pd.DataFrame: The result set, or empty DataFrame on error.
-    """
-    full_url = f"{url}/{db}.json"
-    params = {"sql": sql, "_shape": "array"}
-
-    http = get_http_session()
-    response = http.get(full_url, params=params)
-    response.raise_for_status()
-    return pd.DataFrame.from_dict(response.json())
+# Only endpoints for the mapped pipelines can match the expected grid, so the rest are
+# filtered out by Datasette rather than downloaded
+ENDPOINTS_URL = (
+    "https://datasette.planning.data.gov.uk/performance/reporting_latest_endpoints.csv?_stream=on"
+    "&pipeline__in=" + ",".join(pipeline for pipelines in ALL_PIPELINES.values() for pipeline in pipelines)
+)
+
+# Endpoint columns carried into the output, blank where no endpoint exists
+ENDPOINT_COLUMNS = [
+    "endpoint",
+    "endpoint_url",
+    "licence",
+    "status",
+    "days_since_200",
+    "exception",
+    "resource",
+    "latest_log_entry_date",
+    "endpoint_entry_date",
+    "endpoint_end_date",
+    "resource_start_date",
+    "resource_end_date",
+]
+
+# Columns read from reporting_latest_endpoints, before renaming to the output names
+ENDPOINT_SOURCE_COLUMNS = [
+    "organisation",
+    "collection",
+    "pipeline",
+    "endpoint",
+    "endpoint_url",
+    "licence",
+    "latest_status",
+    "days_since_200",
+    "latest_exception",
+    "resource",
+    "latest_log_entry_date",
+    "endpoint_entry_date",
+    "endpoint_end_date",
+    "resource_start_date",
+    "resource_end_date",
+]
 
 # Data Retrieval Functions
+PROVISIONS_SQL = """
+    SELECT
+        p.cohort,
+        p.organisation,
+        c.start_date as cohort_start_date,
+        org.name as name
+    FROM provision p
+    INNER JOIN cohort c ON c.cohort = p.cohort
+    INNER JOIN organisation org ON org.organisation = p.organisation
+    WHERE p.provision_reason = "expected"
+      AND p.project = "open-digital-planning"
+    GROUP BY p.organisation, p.cohort
+"""
+
 def get_provisions():
     """
     Retrieves provision records showing which organisations are expected to 
@@ -56,81 +96,24 @@ def get_provisions():
     Returns:
         pd.DataFrame: Provision table including cohort and organisation names.
     """
-    sql = """
-        SELECT
-            p.cohort,
-            p.organisation,
-            c.start_date as cohort_start_date,
-            org.name as name
-        FROM provision p
-        INNER JOIN cohort c ON c.cohort = p.cohort
-        INNER JOIN organisation org ON org.organisation = p.organisation
-        WHERE p.provision_reason = "expected"
-          AND p.project = "open-digital-planning"
-        GROUP BY p.organisation, p.cohort
-    """
-    return get_datasette_query("digital-land", sql)
-
-
-def get_endpoints_chunk(offset: int) -> pd.DataFrame:
-    """
-    Retrieves a paginated chunk of endpoint reporting data.
-
-    Args:
-        offset (int): Pagination offset for the query.
-
-    Returns:
-        pd.DataFrame: Chunk of endpoint data.
-    """
-    sql = f"""
-        SELECT
-            rle.organisation,
-            rle.collection,
-            rle.pipeline,
-            rle.endpoint,
-            rle.endpoint_url,
-            rle.licence,
-            rle.latest_status as status,
-            rle.days_since_200,
-            rle.latest_exception as exception,
-            rle.resource,
-            rle.latest_log_entry_date,
-            rle.endpoint_entry_date,
-            rle.endpoint_end_date,
-            rle.resource_start_date,
-            rle.resource_end_date
-        FROM reporting_latest_endpoints rle
-        LIMIT 1000 OFFSET {offset}
-    """
-    return get_datasette_query("performance", sql)
+    return get_datasette_query("digital-land", PROVISIONS_SQL, SESSION)
 
 
 def get_endpoints() -> pd.DataFrame:
     """
-    Retrieves all endpoint reporting data using pagination.
+    Retrieves all endpoint reporting data as a single streamed CSV download.
 
     Returns:
         pd.DataFrame: Combined table of all endpoint metadata and status.
     """
-    df_list = []
-    offset = 0
-
-    while True:
-        chunk = get_endpoints_chunk(offset)
-        if chunk.empty:
-            break
-        df_list.append(chunk)
-        if len(chunk) < 1000:
-            break
-        offset += 1000
-
-    if not df_list:
-        return pd.DataFrame()
-
-    df = pd.concat(df_list, ignore_index=True)
-
-    # Normalise organisation codes (remove -eng suffix)
-    df["organisation"] = df["organisation"].str.replace("-eng", "", regex=False)
+    # Datasette streams every row of a table export, so no paging is needed; values are
+    # kept as text, exactly as stored
+    df = read_csv_arrow(ENDPOINTS_URL, {column: pa.string() for column in ENDPOINT_SOURCE_COLUMNS})
+    df = df.rename(columns={"latest_status": "status", "latest_exception": "exception"})
+
+    # Normalise organisation codes (remove -eng suffix) in a single Arrow kernel
+    organisation = pa.array(df["organisation"], type=pa.string(), from_pandas=True)
+    df["organisation"] = pc.replace_substring(organisation, "-eng", "").to_numpy(zero_copy_only=False)
     return df
 
 # CSV Export Logic
@@ -146,72 +129,33 @@ def generate_odp_summary_csv(output_dir: str) -> str:
     """
     provisions = get_provisions()
     endpoints = get_endpoints()
-    output_rows = []
-
-    for _, row in provisions.iterrows():
-        organisation = row["organisation"]
-        cohort = row["cohort"]
-        name = row["name"]
-        cohort_start_date = row["cohort_start_date"]
-
-        for collection, pipelines in ALL_PIPELINES.items():
-            for pipeline in pipelines:
-                match = endpoints[
-                    (endpoints["organisation"] == organisation) &
-                    (endpoints["pipeline"] == pipeline)
-                ]
-
-                if not match.empty:
-                    # Endpoint(s) exist — add one row per match
-                    for _, ep in match.iterrows():
-                        output_rows.append({
-                            "organisation": organisation,
-                            "cohort": cohort,
-                            "name": name,
-                            "collection": collection,
-                            "pipeline": pipeline,
-                            "endpoint": ep["endpoint"],
-                            "endpoint_url": ep["endpoint_url"],
-                            "licence": ep["licence"],
-                            "status": ep["status"],
-                            "days_since_200": ep["days_since_200"],
-                            "exception": ep["exception"],
-                            "resource": ep["resource"],
-                            "latest_log_entry_date": ep["latest_log_entry_date"],
-                            "endpoint_entry_date": ep["endpoint_entry_date"],
-                            "endpoint_end_date": ep["endpoint_end_date"],
-                            "resource_start_date": ep["resource_start_date"],
-                            "resource_end_date": ep["resource_end_date"],
-                            "cohort_start_date": cohort_start_date,
-                        })
-                else:
-                    # No endpoint — mark as missing
-                    output_rows.append({
-                        "organisation": organisation,
-                        "cohort": cohort,
-                        "name": name,
-                        "collection": collection,
-                        "pipeline": pipeline,
-                        "endpoint": "No endpoint added",
-                        "endpoint_url": "",
-                        "licence": "",
-                        "status": "",
-                        "days_since_200": "",
-                        "exception": "",
-                        "resource": "",
-                        "latest_log_entry_date": "",
-                        "endpoint_entry_date": "",
-                        "endpoint_end_date": "",
-                        "resource_start_date": "",
-                        "resource_end_date": "",
-                        "cohort_start_date": cohort_start_date,
-                    })
-
-    # Convert output to DataFrame and save as CSV
-    df_final = pd.DataFrame(output_rows)
+
+    # Every provision is expected to publish every pipeline; expand to that grid
+    # (provision order, then pipeline order) and attach matching endpoints in one join
+    pipelines = pd.DataFrame(
+        [(collection, pipeline) for collection, pipelines in ALL_PIPELINES.items() for pipeline in pipelines],
+        columns=["collection", "pipeline"],
+    )
+    expected = provisions[["organisation", "cohort", "name", "cohort_start_date"]].merge(pipelines, how="cross")
+    df_final = expected.merge(
+        endpoints[["organisation", "pipeline"] + ENDPOINT_COLUMNS],
+        on=["organisation", "pipeline"],
+        how="left",
+        indicator=True,
+    )
+
+    # No endpoint — mark as missing
+    missing = (df_final.pop("_merge") == "left_only").to_numpy()
+    df_final.loc[missing, ENDPOINT_COLUMNS] = ""
+    df_final.loc[missing, "endpoint"] = "No endpoint added"
+    df_final = df_final[
+        ["organisation", "cohort", "name", "collection", "pipeline"] + ENDPOINT_COLUMNS + ["cohort_start_date"]
+    ]
+
+    # Save as CSV
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, "odp_status.csv")
-    df_final.to_csv(output_path, index=False)
+    write_csv(df_final, output_path)
     print(f"CSV generated at {output_path} with {len(df_final)} rows")
     return output_path
 
@@ -1,13 +1,60 @@
-import pandas as pd
-import urllib.parse
+import csv
+import io
 import os
 import argparse
-from utils import get_http_session
+from concurrent.futures import ThreadPoolExecutor
+from utils import REQUEST_TIMEOUT, get_http_session
+
+# Output column names, where they differ from the query's
+COLUMN_RENAMES = {"endpoint_count": "total_requests"}
+
+# Queries are independent and network-bound, so run several at once
+MAX_WORKERS = 8
+
+def fetch_and_save(http, name: str, url: str, sql: str, save_dir: str):
+    """
+    Runs one SQL query against a Datasette URL and saves the result as {name}.csv.
+    Failures are logged and skipped, so one bad query doesn't stop the others.
+    """
+    try:
+        # Define the output CSV filename
+        csv_name = f"{name}.csv"
+
+        # CSV API URL; requests encodes the SQL query parameter
+        full_url = f"{url}.csv"
+
+        print(f"Fetching: {name} from SQL URL:\n{full_url}")
+
+        # Fetch CSV data; rows are copied through the csv module rather than parsed into a DataFrame
+        response = http.get(full_url, params={"sql": sql}, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        # Datasette ends lines with \r\n; csv.reader also keeps line breaks inside quoted values in one row
+        reader = csv.reader(io.StringIO(response.content.decode("utf-8"), newline=""))
+
+        # rename column to match expected
+        columns = [COLUMN_RENAMES.get(c, c) for c in next(reader)]
+
+        # Save CSV in the specified directory, rewritten row by row with \n line endings
+        save_path = os.path.join(save_dir, csv_name)
+        with open(save_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(columns)
+            row_count = 0
+            for row in reader:
+                writer.writerow(row)
+                row_count += 1
+        print(f"Rows returned: {row_count}")
+        print(f"Saved: {save_path}")
+
+    except Exception as e:
+        # Log failure and continue
+        print(f"Failed to fetch from {url}: {e}")
 
 def sql_queried_datasette_tables(urls: dict, sqls: list, save_dir: str):
     """
     Fetches data from a dictionary of Datasette URLs using optional SQL queries
-    and saves each result as a CSV file in the specified directory.
+    and saves each result as a CSV file in the specified directory. The queries
+    run concurrently on a thread pool.
 
     Args:
         urls (dict): Mapping of table names to Datasette base URLs.
@@ -23,36 +70,13 @@ def sql_queried_datasette_tables(urls: dict, sqls: list, save_dir: str):
     # Ensure the output directory exists
     os.makedirs(save_dir, exist_ok=True)
 
-    # Iterate over each (name, URL) and associated SQL
-    for (name, url), sql in zip(urls.items(), sqls):
-        try:
-            # Define the output CSV filename
-            csv_name = f"{name}.csv"
-
-            # Encode SQL query and construct JSON API URL
-            encoded_sql = urllib.parse.quote(sql)
-            full_url = f"{url}.json?sql={encoded_sql}&_shape=array"
-            
-            print(f"Fetching: {name} from SQL URL:\n{full_url}")
-
-            # Fetch JSON data and load into DataFrame
-            response = get_http_session().get(full_url)
-            response.raise_for_status()
-            data = response.json()
-            print(f"Rows returned: {len(data)}")
-            df = pd.DataFrame(data)
-
-            # rename column to match expected
-            df.rename(columns={'endpoint_count': 'total_requests'}, inplace=True)
-
-            # Save DataFrame to CSV in the specified directory
-            save_path = os.path.join(save_dir, csv_name)
-            df.to_csv(save_path, index=False)
-            print(f"Saved: {save_path}")
-
-        except Exception as e:
-            # Log failure and continue
-            print(f"Failed to fetch from {url}: {e}")
+    # One Session for all queries, so retries and the connection pool are shared
+    http = get_http_session(pool_maxsize=MAX_WORKERS)
+
+    # Fetch each (name, URL) and associated SQL
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for (name, url), sql in zip(urls.items(), sqls):
+            executor.submit(fetch_and_save, http, name, url, sql, save_dir)
 
 def parse_args():
     """
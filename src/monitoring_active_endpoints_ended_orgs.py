@@ -2,48 +2,58 @@ import os
 import argparse
 import click
 import pandas as pd
-from utils import read_csv_with_retry
+import pyarrow as pa
+import pyarrow.compute as pc
+from utils import read_csv_with_retry, write_csv
 
 base_url = "https://datasette.planning.data.gov.uk"
 
 def ended_orgs_active_endpoints(output_dir):
     
-    # Organisations (ENDED ONLY: end_date IS NOT NULL)
-    orgs_url = f"{base_url}/digital-land/organisation.csv?_stream=on"
-    orgs_df = read_csv_with_retry(orgs_url, low_memory=False)
+    # Organisations (ENDED ONLY: end_date IS NOT NULL), filtered by Datasette
+    orgs_url = f"{base_url}/digital-land/organisation.csv?_stream=on&end_date__notblank=1"
+    orgs_df = read_csv_with_retry(
+        orgs_url,
+        low_memory=False,
+        usecols=["name", "entity", "reference", "dataset"],
+        dtype={"dataset": str, "reference": str},
+    )
 
     ended_orgs_df = (
-        orgs_df.loc[orgs_df["end_date"].notna(), ["name", "entity", "reference", "dataset"]]
-        .rename(columns={
+        orgs_df.rename(columns={
             "name": "organisation_name",
             "entity": "organisation_entity",
         })
     )
 
-    ended_orgs_df["organisation_code"] = ended_orgs_df["dataset"] + ":" + ended_orgs_df["reference"]
+    # Joined in one Arrow kernel; a missing part gives a missing code, as with string concatenation
+    ended_orgs_df["organisation_code"] = pc.binary_join_element_wise(
+        pa.array(ended_orgs_df["dataset"], type=pa.string(), from_pandas=True),
+        pa.array(ended_orgs_df["reference"], type=pa.string(), from_pandas=True),
+        ":",
+    ).to_numpy(zero_copy_only=False)
     ended_orgs_df = ended_orgs_df.drop(columns=["reference", "dataset"])
 
-    # Endpoints (ACTIVE ONLY: endpoint_end_date IS NULL)
-    endpoints_url = f"{base_url}/performance/reporting_historic_endpoints.csv?_stream=on"
-    endpoints_df = read_csv_with_retry(endpoints_url, low_memory=False)
-
-    active_endpoints_df = endpoints_df[endpoints_df["endpoint_end_date"].isna()].copy()
-
-    # Keep only required fields (plus dataset name)
-    active_endpoints_df = active_endpoints_df.rename(columns={"dataset": "dataset_name"})
-    active_endpoints_df = active_endpoints_df[
-        [
+    # Endpoints (ACTIVE ONLY: endpoint_end_date IS NULL), filtered by Datasette so ended
+    # endpoints are never downloaded; only the required fields are parsed
+    endpoints_url = f"{base_url}/performance/reporting_historic_endpoints.csv?_stream=on&endpoint_end_date__isblank=1"
+    active_endpoints_df = read_csv_with_retry(
+        endpoints_url,
+        low_memory=False,
+        usecols=[
             "organisation",
-            "dataset_name",
+            "dataset",
             "endpoint_url",
             "endpoint_entry_date",
             "endpoint_end_date",        # will be NaN for active, but required in output
             "latest_status",                   # latest log status
             "latest_log_entry_date",
-        ]
-    ]
+        ],
+    )
 
-    active_endpoints_df = active_endpoints_df.rename(columns={"organisation":"organisation_code","latest_status":"status"})
+    active_endpoints_df = active_endpoints_df.rename(
+        columns={"organisation": "organisation_code", "dataset": "dataset_name", "latest_status": "status"}
+    )
 
     # --- Merge on organisation_code to get "active endpoints from ended organisations"
     merged_df = ended_orgs_df.merge(active_endpoints_df, how="inner", on="organisation_code")
@@ -70,7 +80,7 @@ def ended_orgs_active_endpoints(output_dir):
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, "ended_orgs_active_endpoints.csv")
 
-    merged_df.to_csv(output_path, index=False)
+    write_csv(merged_df, output_path)
 
 @click.command()
 @click.option("--output-dir", required=True)
@@ -1,13 +1,13 @@
-from itertools import islice
 from urllib.parse import urlparse
-import requests
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import click
 import argparse
 import os
-import time
 import logging
-from utils import get_http_session, read_csv_with_retry
+from concurrent.futures import ThreadPoolExecutor
+from utils import get_http_session, read_csv_with_retry, write_csv
 
 # ---------------------------------------
 # Config
@@ -15,6 +15,10 @@ from utils import get_http_session, read_csv_with_retry
 BASE_DB = "https://datasette.planning.data.gov.uk/digital-land"  # DB path
 BASE_HOST = "https://datasette.planning.data.gov.uk"             # domain root
 UA = {"User-Agent": "Mozilla/5.0 (compatible; slug-fetcher/1.0)"}
+# Entity tables are downloaded one database per slug, so fetch several at once
+MAX_WORKERS = 16
+# Shared by the download threads, with a connection per worker to the single Datasette host
+SESSION = get_http_session(pool_maxsize=MAX_WORKERS)
 WANTED = ["dataset", "entity", "entry_date", "reference", "name", "organisation_entity"]
 logger = logging.getLogger(__name__)
 
@@ -45,15 +49,6 @@ def fetch_sql_df(base_url: str, sql: str, timeout: int = 60) -> pd.DataFrame:
     return pd.DataFrame(data) if data else pd.DataFrame()
 
 
-def chunked(iterable, size):
-    it = iter(iterable)
-    while True:
-        chunk = list(islice(it, size))
-        if not chunk:
-            break
-        yield chunk
-
-
 def get_all_dataset_slugs(base_db: str = BASE_DB) -> list:
     """
     Pull dataset slugs from the dataset registry table.
@@ -66,42 +61,37 @@ def get_all_dataset_slugs(base_db: str = BASE_DB) -> list:
     return sorted(df["dataset"].dropna().astype(str).unique().tolist())
 
 
+def read_slug_entities(slug, base_host=BASE_HOST, wanted_cols=WANTED):
+    """
+    Read {base_host}/{slug}/entity.csv?_stream=on and normalise it to wanted_cols.
+    Returns None if the slug has no entity table or the read fails.
+    """
+    url = f"{base_host}/{slug}/entity.csv?_stream=on"
+    try:
+        # no HEAD probe first; a missing table fails the read itself
+        df = read_csv_with_retry(url, SESSION, low_memory=False, usecols=lambda c: c in wanted_cols)
+    except Exception:
+        # skip problematic slug
+        return None
+
+    # ensure wanted columns exist, adding any missing ones in a single reindex
+    df = df.reindex(columns=wanted_cols)
+
+    # fill dataset with slug if missing/blank
+    df["dataset"] = df["dataset"].fillna(slug)
+
+    return df
+
+
 def build_total_slug_df(slugs, base_host=BASE_HOST, wanted_cols=WANTED) -> pd.DataFrame:
     """
     For each slug, try {base_host}/{slug}/entity.csv?_stream=on.
     If available, read, normalise to wanted_cols, and concat.
+    Each slug is a separate database, so the downloads run concurrently.
     """
-    frames = []
-    for slug in slugs:
-        url = f"{base_host}/{slug}/entity.csv?_stream=on"
-        try:
-            # quick existence probe; allow 403/405 (HEAD often blocked)
-            head = requests.head(url, timeout=20, allow_redirects=True)
-            if head.status_code not in (200, 403, 405):
-                # no endpoint — skip
-                continue
-
-            # try CSV read directly
-            df = pd.read_csv(url, low_memory=False)
-
-            # ensure wanted columns exist
-            for c in wanted_cols:
-                if c not in df.columns:
-                    df[c] = pd.NA
-
-            # fill dataset with slug if missing/blank
-            if df["dataset"].isna().all():
-                df["dataset"] = slug
-            else:
-                df["dataset"] = df["dataset"].fillna(slug)
-
-            frames.append(df[wanted_cols])
-
-        except Exception:
-            # skip problematic slug and continue
-            continue
-        finally:
-            time.sleep(0.03) 
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(lambda slug: read_slug_entities(slug, base_host, wanted_cols), slugs)
+        frames = [df for df in results if df is not None]
 
     return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=wanted_cols)
 
@@ -121,29 +111,38 @@ def build_dataset(output_dir):
     slugs = get_all_dataset_slugs(BASE_DB)
     total_slug_df = build_total_slug_df(slugs, base_host=BASE_HOST, wanted_cols=WANTED)
 
-    # 2) Organisations (ENDED ONLY: end_date IS NOT NULL)
-    orgs_url = f"{BASE_HOST}/digital-land/organisation.csv?_stream=on"
-    orgs_df = read_csv_with_retry(orgs_url, low_memory=False)
-
-    ended_orgs_df = (
-        orgs_df.loc[orgs_df["end_date"].notna(), ["name", "entity", "reference", "dataset", "end_date"]]
-            .rename(columns={
-                "name": "organisation_name",
-                "entity": "organisation_entity",
-                "end_date": "organisation_end_date",
-            })
-            .copy()
+    # 2) Organisations (ENDED ONLY: end_date IS NOT NULL), filtered by Datasette and
+    #    parsing only the columns used
+    orgs_url = f"{BASE_HOST}/digital-land/organisation.csv?_stream=on&end_date__notblank=1"
+    org_cols = ["name", "entity", "reference", "dataset", "end_date"]
+    # dataset and reference are read as text so the Arrow string join below accepts them
+    orgs_df = read_csv_with_retry(
+        orgs_url, low_memory=False, usecols=org_cols, dtype={"dataset": str, "reference": str}
     )
-    ended_orgs_df["organisation_code"] = ended_orgs_df["dataset"].astype(str) + ":" + ended_orgs_df["reference"].astype(str)
+
+    # usecols keeps the file's column order, so select to fix the output order
+    ended_orgs_df = orgs_df[org_cols].rename(columns={
+        "name": "organisation_name",
+        "entity": "organisation_entity",
+        "end_date": "organisation_end_date",
+    })
+    # Joined in one Arrow kernel; a missing dataset or reference is written as "nan"
+    ended_orgs_df["organisation_code"] = pc.binary_join_element_wise(
+        pa.array(ended_orgs_df["dataset"], type=pa.string(), from_pandas=True),
+        pa.array(ended_orgs_df["reference"], type=pa.string(), from_pandas=True),
+        ":",
+        null_handling="replace",
+        null_replacement="nan",
+    ).to_numpy(zero_copy_only=False)
     ended_orgs_df = ended_orgs_df.drop(columns=["reference", "dataset"])
 
-    # 3) Merge entities with ended orgs on organisation_entity
-    merge_df = ended_orgs_df.merge(total_slug_df, how="inner", on="organisation_entity")
+    # 3) Merge entities with ended orgs on organisation_entity (one org to many entities)
+    merge_df = ended_orgs_df.merge(total_slug_df, how="inner", on="organisation_entity", validate="one_to_many")
 
     # 4) Save to args.output_dir
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, "entities_with_ended_orgs.csv")
-    merge_df.to_csv(output_path, index=False)
+    write_csv(merge_df, output_path)
     logger.info(f"Saved: {output_path}")
 
 @click.command()
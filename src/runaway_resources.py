@@ -1,84 +1,91 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+import pyarrow as pa
+from datetime import datetime
 import argparse
 import os
-from utils import read_csv_with_retry
+from utils import read_csv_arrow, write_csv
 
 def main(output_dir):
     # Load Data
     base_url = "https://datasette.planning.data.gov.uk/digital-land"
     table = "reporting_historic_endpoints"
-    full_url = f"{base_url}/{table}.csv?_stream=on"
-
-    df = read_csv_with_retry(full_url, low_memory=False)
-
-    # Filter and convert dates
-    df = df[df["endpoint_end_date"].isna()].copy()
-    df["resource_start_date"] = pd.to_datetime(df["resource_start_date"])
-    df["resource_end_date"] = pd.to_datetime(df["resource_end_date"])
-
-    # Build summary dataframe
-    summary_df = (
-        df.groupby("endpoint")
-        .size()
-        .reset_index(name="resource_count")
-        .query("resource_count > 1")
-        .sort_values("resource_count", ascending=False)
-        .reset_index(drop=True)
+    # Only live endpoints are needed, so Datasette filters out ended ones before download
+    full_url = f"{base_url}/{table}.csv?_stream=on&endpoint_end_date__isblank=1"
+
+    # Parse only the columns used with pyarrow's multi-threaded reader, each with an
+    # explicit type so none is inferred: low-cardinality text is dictionary-encoded
+    # while parsing and arrives as categoricals, so grouping works on integer codes
+    category = pa.dictionary(pa.int32(), pa.string())
+    df = read_csv_arrow(
+        full_url,
+        {
+            "endpoint": category,
+            "organisation_name": category,
+            "dataset": category,
+            "collection": category,
+            "pipeline": category,
+            "endpoint_entry_date": pa.string(),
+            "resource_start_date": pa.timestamp("ns"),
+            "resource_end_date": pa.timestamp("ns"),
+        },
     )
-
-    # Add metadata columns
-    meta_cols = ["organisation_name", "dataset", "collection", "pipeline", "endpoint_entry_date"]
-    metadata = df.groupby("endpoint")[meta_cols].first().reset_index()
-    summary_df = summary_df.merge(metadata, on="endpoint", how="left")
-
-    # First and last start dates
-    first_dates = df.groupby("endpoint")["resource_start_date"].min().dt.date
-    last_dates = df.groupby("endpoint")["resource_start_date"].max().dt.date
-
-    # Count single-day resources (same start and end date)
-    single_day_counts = df[df["resource_start_date"] == df["resource_end_date"]]
-    single_day_summary = single_day_counts.groupby("endpoint").size()
-
-    # Insert derived columns
-    summary_df.insert(1, "first_resource_start_date", summary_df["endpoint"].map(first_dates))
-    summary_df.insert(2, "last_resource_start_date", summary_df["endpoint"].map(last_dates))
-    summary_df.insert(9, "single_day_resources", summary_df["endpoint"].map(single_day_summary).fillna(0).astype(int))
+    # Dictionary order is first appearance; sort it so endpoints group in name order
+    df["endpoint"] = df["endpoint"].cat.reorder_categories(df["endpoint"].cat.categories.sort_values())
 
     # Flagging logic
-    today = datetime.today().date()
-    recent_7_days = today - timedelta(days=7)
-    recent_30_days = today - timedelta(days=30)
+    today = np.datetime64(datetime.today().date(), "D")
+    stale_cutoff = today - np.timedelta64(30, "D")
+
+    # Whole days before today of each resource start as plain integers, so the windows
+    # are integer comparisons; resources without a start date match no window
+    start_days = df["resource_start_date"].to_numpy(dtype="datetime64[D]")
+    has_start = ~np.isnat(start_days)
+    start_day_offset = (today - start_days).view("int64")
+    in_last_7 = has_start & (start_day_offset >= 1) & (start_day_offset <= 7)
+
+    # Per-resource helper columns, so every per-endpoint figure comes from one groupby:
+    # single-day resources (same start and end date), the day of any start in the
+    # 7 days before today, and starts in the last 30 days
+    df["is_single_day"] = df["resource_start_date"] == df["resource_end_date"]
+    df["streak_day"] = np.where(in_last_7, start_day_offset, np.nan)
+    df["in_last_30"] = has_start & (start_day_offset <= 30)
 
-    # Daily streak for last 7 days
-    seven_day_df = df[df["resource_start_date"].dt.date >= recent_7_days]
-    start_dates_7 = seven_day_df.groupby("endpoint")["resource_start_date"].apply(lambda x: set(x.dt.date))
-    expected_last_7 = set(today - timedelta(days=i) for i in range(1, 8))
-
-    summary_df["daily_for_7_days"] = summary_df["endpoint"].apply(
-        lambda ep: "yes" if expected_last_7.issubset(start_dates_7.get(ep, set())) else "no"
-    )
-
-    # More than 20 new resources in last 30 days
-    thirty_day_df = df[df["resource_start_date"].dt.date >= recent_30_days]
-    resource_count_30 = thirty_day_df.groupby("endpoint").size()
-
-    summary_df[">20_instances_in_30_day_period"] = summary_df["endpoint"].apply(
-        lambda ep: "yes" if resource_count_30.get(ep, 0) > 20 else "no"
+    meta_cols = ["organisation_name", "dataset", "collection", "pipeline", "endpoint_entry_date"]
+    grouped = df.groupby("endpoint", observed=True).agg(
+        resource_count=("endpoint", "size"),
+        first_start=("resource_start_date", "min"),
+        last_start=("resource_start_date", "max"),
+        last_end=("resource_end_date", "max"),
+        single_day=("is_single_day", "sum"),
+        streak_days=("streak_day", "nunique"),
+        count_30=("in_last_30", "sum"),
+        **{c: (c, "first") for c in meta_cols},
     )
 
-    # Flag endpoints with stale resource end dates
-    last_end_dates = df.groupby("endpoint")["resource_end_date"].max().dt.date
-    stale_cutoff = today - timedelta(days=30)
-
-    summary_df["stale_resource"] = summary_df["endpoint"].apply(
-        lambda ep: "yes" if pd.notnull(last_end_dates.get(ep)) and last_end_dates.get(ep) < stale_cutoff else "no"
-    )
+    # Build summary dataframe
+    grouped = grouped[grouped["resource_count"] > 1].reset_index()
+    grouped = grouped.sort_values("resource_count", ascending=False).reset_index(drop=True)
+
+    summary_df = pd.DataFrame({
+        "endpoint": grouped["endpoint"],
+        "first_resource_start_date": grouped["first_start"].dt.date,
+        "last_resource_start_date": grouped["last_start"].dt.date,
+        "resource_count": grouped["resource_count"],
+        **{c: grouped[c] for c in meta_cols},
+        "single_day_resources": grouped["single_day"].astype(int),
+        # Daily streak for last 7 days: a resource started on each of the 7 days before today
+        "daily_for_7_days": np.where(grouped["streak_days"] == 7, "yes", "no"),
+        # More than 20 new resources in last 30 days
+        ">20_instances_in_30_day_period": np.where(grouped["count_30"] > 20, "yes", "no"),
+        # Flag endpoints with stale resource end dates
+        "stale_resource": np.where(grouped["last_end"].to_numpy(dtype="datetime64[D]") < stale_cutoff, "yes", "no"),
+    })
 
     # Output
     csv_name = "runaway_resources.csv"
     save_path = os.path.join(output_dir, csv_name)
-    summary_df.to_csv(save_path, index=False)  # Save to CSV without index
+    write_csv(summary_df, save_path)  # Save to CSV without index
     print(f"Saved: {save_path}")
 
 def parse_args():
@@ -1,21 +1,213 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from io import StringIO
+from io import BytesIO
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
+# Optional on-disk cache for downloads, revalidated against the server once older than the TTL
+CACHE_DIR = os.environ.get("REPORTING_CACHE_DIR")
+CACHE_TTL = int(os.environ.get("REPORTING_CACHE_TTL", "0"))
 
-def get_http_session() -> requests.Session:
-    """Returns a requests Session with retry for transient server errors (502, 503, 504)."""
+DATASETTE_URL = "https://datasette.planning.data.gov.uk"
+
+# (connect, read) timeouts in seconds so a stalled download fails and is retried
+REQUEST_TIMEOUT = (10, 120)
+
+# Session shared by every fetch_with_cache call in the process, created on first use
+_SESSION = None
+
+
+def get_http_session(pool_maxsize: int = 10) -> requests.Session:
+    """
+    Returns a requests Session with retry for transient server errors (502, 503, 504).
+
+    pool_maxsize is the number of connections kept open per host, so a Session shared
+    by that many threads reuses connections instead of opening new ones.
+    """
     retry = Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
     session = requests.Session()
-    session.mount("https://", HTTPAdapter(max_retries=retry))
+    session.mount("https://", HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize))
     return session
 
 
-def read_csv_with_retry(url: str, **kwargs) -> pd.DataFrame:
-    """Fetch a CSV from a URL with retry logic and parse into a DataFrame."""
-    session = get_http_session()
-    response = session.get(url)
+def fetch_with_cache(url: str, session: requests.Session = None) -> bytes:
+    """
+    Fetch the body of a URL with retry logic.
+
+    When REPORTING_CACHE_DIR is set, responses are kept on disk with their ETag and
+    Last-Modified headers, and a 304 Not Modified answer to the conditional request
+    serves the cached copy instead of downloading the body again. Copies younger
+    than REPORTING_CACHE_TTL seconds are served without contacting the server.
+
+    Pass a session sized to the caller's thread pool when fetching from many threads;
+    otherwise the process-wide session is used.
+    """
+    global _SESSION
+    if session is None:
+        if _SESSION is None:
+            _SESSION = get_http_session()
+        session = _SESSION
+    if not CACHE_DIR:
+        response = session.get(url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+    body_path = os.path.join(CACHE_DIR, hashlib.sha256(url.encode()).hexdigest())
+    meta_path = f"{body_path}.json"
+    headers = {}
+    if os.path.exists(body_path) and os.path.exists(meta_path):
+        if time.time() - os.path.getmtime(meta_path) < CACHE_TTL:
+            with open(body_path, "rb") as f:
+                return f.read()
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304:
+        # Restart the TTL from this successful revalidation
+        os.utime(meta_path)
+        with open(body_path, "rb") as f:
+            return f.read()
     response.raise_for_status()
-    return pd.read_csv(StringIO(response.text), **kwargs)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    meta = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    # Body before meta, each moved into place whole, so a concurrent reader never sees a partial file
+    _write_atomic(body_path, response.content)
+    _write_atomic(meta_path, json.dumps(meta).encode())
+    return response.content
+
+
+def _write_atomic(path: str, data: bytes):
+    """Write data to a temporary file beside path and rename it over path."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_datasette_query(db: str, sql: str, session: requests.Session = None, url: str = DATASETTE_URL) -> pd.DataFrame:
+    """
+    Run SQL against a Datasette database and return the rows as a DataFrame.
+
+    Rows are requested as arrays with one column list, rather than an object per row
+    repeating every key. Pass a shared session to reuse its pooled connections;
+    otherwise a new retrying session is used.
+    """
+    session = session or get_http_session()
+    response = session.get(
+        f"{url}/{db}.json", params={"sql": sql, "_shape": "arrays", "_size": "max"}, timeout=REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
+    body = response.json()
+    return pd.DataFrame(body["rows"], columns=body["columns"])
+
+
+def get_pages(get_page, row_count: int, page_size: int = 1000, max_workers: int = 8) -> list:
+    """
+    Fetch every page of a paged query concurrently, given its total row count.
+
+    get_page is called with each offset and the pages are returned in offset order.
+    The first page is always fetched, so an empty result keeps the columns Datasette
+    gives it.
+    """
+    offsets = range(0, max(row_count, 1), page_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(get_page, offsets))
+
+
+def read_csv_with_retry(url: str, session: requests.Session = None, **kwargs) -> pd.DataFrame:
+    """Fetch a CSV from a URL with retry logic and parse into a DataFrame."""
+    return pd.read_csv(BytesIO(fetch_with_cache(url, session)), **kwargs)
+
+
+def read_csv_arrow(url: str, column_types: dict) -> pd.DataFrame:
+    """
+    Fetch a CSV from a URL with retry logic and parse it with pyarrow's multi-threaded reader.
+
+    Only the columns named in column_types are read, each with the given Arrow type, so
+    no types are inferred (e.g. date-like text stays text). Empty fields are read as
+    nulls and integer columns arrive as nullable Int64.
+    """
+    table = pacsv.read_csv(
+        BytesIO(fetch_with_cache(url)),
+        read_options=pacsv.ReadOptions(block_size=8 << 20, use_threads=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types=column_types,
+            include_columns=list(column_types),
+            strings_can_be_null=True,
+        ),
+    )
+    return table.to_pandas(types_mapper=_int64_types)
+
+
+def read_parquet_with_retry(url: str, columns: list = None, filters: list = None) -> pd.DataFrame:
+    """
+    Fetch a parquet file from a URL with retry logic and parse into a DataFrame.
+
+    Only the requested columns that exist in the file are decoded, so callers can
+    ask for alternative column names in one pass and check which ones came back.
+    Optional filters (pyarrow DNF, e.g. [("entity", "in", ids)]) skip non-matching
+    row groups and rows while decoding; if a filter can't be applied to the file's
+    column types the whole file is read instead.
+    """
+    body = fetch_with_cache(url)
+    parquet_file = pq.ParquetFile(pa.BufferReader(body))
+    if columns is not None:
+        available = set(parquet_file.schema_arrow.names)
+        columns = [c for c in dict.fromkeys(columns) if c in available]
+    table = None
+    if filters:
+        try:
+            table = pq.read_table(pa.BufferReader(body), columns=columns, filters=filters, use_pandas_metadata=True)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            table = None
+    if table is None:
+        table = parquet_file.read(columns=columns, use_pandas_metadata=True)
+    return table.to_pandas(types_mapper=_int64_types)
+
+
+def _int64_types(arrow_type):
+    # Integer columns convert to nullable Int64 directly rather than via float64
+    return pd.Int64Dtype() if pa.types.is_integer(arrow_type) else None
+
+
+def to_int64(series: pd.Series) -> pd.Series:
+    """Coerce a Series to nullable Int64, skipping the numeric parse when it's already integer."""
+    if isinstance(series.dtype, pd.Int64Dtype):
+        return series
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return series.astype("Int64")
+    return pd.to_numeric(series, errors="coerce").astype("Int64")
+
+
+def write_csv(df: pd.DataFrame, path: str, columns: list = None, compression="infer") -> None:
+    """
+    Write a published report CSV without the index, optionally selecting columns.
+
+    Output is pandas' own to_csv, so quoting, empty values and number formatting stay
+    byte-for-byte what the reports have always contained. Paths ending in .gz are
+    gzip-compressed unless compression (passed to to_csv) says otherwise.
+    """
+    df.to_csv(path, index=False, columns=columns, compression=compression)
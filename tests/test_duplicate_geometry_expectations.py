@@ -0,0 +1,28 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from duplicate_geometry_expectations import parse_details  # noqa: E402
+
+
+class TestParseDetails(unittest.TestCase):
+    def test_json_literals_are_parsed(self):
+        # ast.literal_eval rejects null/true/false, which used to drop every match of the expectation
+        details = '{"matches": [{"entity_a": 1, "entity_b": 2, "organisation_entity_a": null}], "passed": false}'
+        self.assertEqual(
+            parse_details(details),
+            {"matches": [{"entity_a": 1, "entity_b": 2, "organisation_entity_a": None}], "passed": False},
+        )
+
+    def test_python_literals_still_parsed(self):
+        self.assertEqual(parse_details("{'matches': [], 'passed': True}"), {"matches": [], "passed": True})
+
+    def test_unparseable_details_are_empty(self):
+        self.assertEqual(parse_details("not details"), {})
+        self.assertEqual(parse_details(None), {})
+
+
+if __name__ == "__main__":
+    unittest.main()